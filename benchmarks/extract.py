@@ -0,0 +1,34 @@
+"""Measure how fast files are extracted from a BSA archive, with one thread and with many.
+
+Usage:
+    python benchmarks/extract.py [path to a BSA file] [number of threads]
+
+Extracts every file in the archive (the test archive by default) into a temporary folder,
+first in a single thread, then in the given number of threads, and prints the speed in MB/s.
+For example, compare the two on Skyrim - Meshes0.bsa.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from elder_scrolls.bsa_file import BethesdaSoftwareArchive  # noqa: E402
+
+
+DEFAULT_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'test', 'bsa', 'test_v104_zlib.bsa')
+DEFAULT_WORKER_COUNT = os.cpu_count()
+
+
+def main(file_path, workers):
+    with BethesdaSoftwareArchive(file_path) as archive:
+        for worker_count in (1, workers):
+            with tempfile.TemporaryDirectory() as dest:
+                report = archive.extract_all(dest, workers=worker_count)
+            print(f"{worker_count} threads: {report['file_count']} files, {report['size'] / 2 ** 20:.1f} MB "
+                  f"in {report['seconds']:.2f} s, {report['mb_per_second']:.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILE_PATH,
+         int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WORKER_COUNT)
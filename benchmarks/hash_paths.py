@@ -0,0 +1,50 @@
+"""Measure how fast BSA paths are hashed, one at a time and in a batch.
+
+Usage:
+    python benchmarks/hash_paths.py [number of paths]
+
+Hashes generated texture paths (100,000 by default) with `BethesdaSoftwareArchive._calculate_hash`,
+with an empty and with a filled cache, and with `hash_paths`, and prints the paths hashed per second.
+Every case hashes its own paths, so no file name is hashed twice. The folders, 500 of them, are
+shared by the paths of all the cases, as they are in the archives of the game.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from elder_scrolls.bsa_file import BethesdaSoftwareArchive, hash_paths  # noqa: E402
+
+
+DEFAULT_PATH_COUNT = 100000
+
+
+def _hash_one_by_one(paths):
+    for path in paths:
+        folder_name, _, file_name = path.rpartition('\\')
+        BethesdaSoftwareArchive._calculate_hash(folder_name)
+        BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True)
+
+
+def _measure(name, function, paths):
+    start = time.perf_counter()
+    function(paths)
+    seconds = time.perf_counter() - start
+    print(f'{name}: {len(paths) / seconds:,.0f} paths per second')
+
+
+def _get_paths(path_count, first_idx):
+    return [f'textures\\armor\\set{idx % 500:03d}\\piece{idx:07d}_n.dds'
+            for idx in range(first_idx, first_idx + path_count)]
+
+
+def main(path_count):
+    BethesdaSoftwareArchive._calculate_hash.cache_clear()
+    _measure('One by one, empty cache', _hash_one_by_one, _get_paths(path_count, 0))
+    _measure('One by one, filled cache', _hash_one_by_one, _get_paths(path_count, path_count))
+    _measure('hash_paths', hash_paths, _get_paths(path_count, 2 * path_count))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PATH_COUNT)
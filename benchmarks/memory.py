@@ -0,0 +1,43 @@
+"""Measure the memory used per Record object.
+
+Usage:
+    python benchmarks/memory.py [path to an ESM/ESP/ESL file]
+
+Records every record in the file (the test plugin by default), keeps them all alive and
+prints the bytes allocated per record, before and after reading one field from each.
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from elder_scrolls import ElderScrollsFile, Record  # noqa: E402
+
+
+DEFAULT_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'test', 'esp', 'test_basic_esp_functionality.esp')
+MINIMUM_RECORD_COUNT = 100000
+
+
+def main(file_path):
+    with ElderScrollsFile(file_path, use_index_file=False) as elder_scrolls_file:
+        positions = [record._pointer for record in elder_scrolls_file._get_all_records()][1:]
+        positions *= max(1, MINIMUM_RECORD_COUNT // len(positions))
+
+        tracemalloc.start()
+        baseline, _ = tracemalloc.get_traced_memory()
+        records = [Record(elder_scrolls_file._mmap, _pos) for _pos in positions]
+        allocated, _ = tracemalloc.get_traced_memory()
+        per_record = (allocated - baseline) / len(records)
+        print(f'{len(records)} records: {per_record:.0f} bytes per record')
+
+        for record in records:
+            record.editor_id
+        allocated, _ = tracemalloc.get_traced_memory()
+        per_record = (allocated - baseline) / len(records)
+        print(f'After reading EDID: {per_record:.0f} bytes per record')
+        tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FILE_PATH)
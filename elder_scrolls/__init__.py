@@ -19,4 +19,7 @@ __author__ = 'Sinan Ozel'
 
 from .elder_scrolls_file import ElderScrollsFile
 from .record import Record, TES4
-from .field import Field
\ No newline at end of file
+from .field import Field
+from .load_order import LoadOrder
+from .data_folder import DataFolder
+from .string_table import StringTable
@@ -0,0 +1,275 @@
+import io
+import struct
+import zlib
+from array import array
+from typing import List, Optional, Tuple, Union
+
+from .bsa_file import ArchiveFileReader, BethesdaSoftwareArchive
+from .lib import Loader
+
+
+# magic, version, archive type, file count, offset of the name table
+_HEADER = struct.Struct('<4sI4sIQ')
+# Starfield archives have two more unknown fields, and v3 has the compression method after them.
+_HEADER_EXTENSION_SIZES = {1: 0, 2: 8, 3: 12, 7: 0, 8: 0}
+LZ4_COMPRESSION_METHOD = 3
+
+# name hash, extension, folder hash, flags, offset, packed size, original size, padding (0xBAADF00D)
+_GENERAL_FILE_RECORD = struct.Struct('<I4sIIQIII')
+# name hash, extension, folder hash, unknown, chunk count, chunk header size, height, width,
+# mip count, DXGI format, is cube map, tile mode
+_TEXTURE_FILE_RECORD = struct.Struct('<I4sIBBHHHBBBB')
+# offset, packed size, original size, first mip, last mip, padding (0xBAADF00D)
+_TEXTURE_CHUNK = struct.Struct('<QIIHHI')
+
+GENERAL_ARCHIVE = 'GNRL'
+TEXTURE_ARCHIVE = 'DX10'
+
+# DDS headers, rebuilt for textures: https://learn.microsoft.com/en-us/windows/win32/direct3ddds/dds-header
+_DDS_HEADER = struct.Struct('<4s7I44x8I5I')
+_DDS_HEADER_DXT10 = struct.Struct('<5I')
+DDSD_CAPS, DDSD_HEIGHT, DDSD_WIDTH, DDSD_PITCH = 0x1, 0x2, 0x4, 0x8
+DDSD_PIXELFORMAT, DDSD_MIPMAPCOUNT, DDSD_LINEARSIZE = 0x1000, 0x20000, 0x80000
+DDPF_ALPHAPIXELS, DDPF_FOURCC, DDPF_RGB, DDPF_LUMINANCE = 0x1, 0x4, 0x40, 0x20000
+DDSCAPS_COMPLEX, DDSCAPS_TEXTURE, DDSCAPS_MIPMAP = 0x8, 0x1000, 0x400000
+DDSCAPS2_CUBEMAP_ALL_FACES = 0xFE00
+DDS_RESOURCE_MISC_TEXTURECUBE = 0x4
+D3D10_RESOURCE_DIMENSION_TEXTURE2D = 3
+
+# DXGI format: (FourCC, or None for the DX10 header, bytes per 4x4 block)
+_BLOCK_COMPRESSED_FORMATS = {
+    70: (b'DXT1', 8), 71: (b'DXT1', 8), 72: (b'DXT1', 8),
+    73: (b'DXT3', 16), 74: (b'DXT3', 16), 75: (b'DXT3', 16),
+    76: (b'DXT5', 16), 77: (b'DXT5', 16), 78: (b'DXT5', 16),
+    79: (b'BC4U', 8), 80: (b'BC4U', 8), 81: (b'BC4S', 8),
+    82: (b'BC5U', 16), 83: (b'BC5U', 16), 84: (b'BC5S', 16),
+    94: (None, 16), 95: (None, 16), 96: (None, 16),
+    97: (None, 16), 98: (None, 16), 99: (None, 16),
+}
+# DXGI format: (pixel format flags, bits per pixel, red, green, blue and alpha masks)
+_UNCOMPRESSED_FORMATS = {
+    28: (DDPF_RGB | DDPF_ALPHAPIXELS, 32, 0xff, 0xff00, 0xff0000, 0xff000000),
+    87: (DDPF_RGB | DDPF_ALPHAPIXELS, 32, 0xff0000, 0xff00, 0xff, 0xff000000),
+    88: (DDPF_RGB, 32, 0xff0000, 0xff00, 0xff, 0),
+    61: (DDPF_LUMINANCE, 8, 0xff, 0, 0, 0),
+}
+
+
+class BethesdaArchive2(Loader):
+    """Parse a BA2 (BTDX) archive from Fallout 4 or Starfield, with general files (GNRL) or textures (DX10).
+
+    It works in the same way as `BethesdaSoftwareArchive`. Textures are stored without their DDS
+    headers, in chunks of mip maps, so the headers are rebuilt, and the chunks decompressed one by one
+    as they are read.
+
+    Usage example:
+
+    with BethesdaArchive2(os.path.join(game_folder, 'Data', 'Fallout4 - Textures1.ba2')) as archive:
+        with archive.open('Textures\\Actors\\Character\\BaseHumanFemale\\BaseFemaleHead_d.dds') as texture:
+            dds_header = texture.read(128)
+    """
+
+    path = BethesdaSoftwareArchive.path
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        try:
+            self._header = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            raise RuntimeError(f'Incorrect file header - is {self.file_path} a BA2 file?')
+        self._data = memoryview(self._mmap)
+
+    def __enter__(self):
+        if self._header[0] != b'BTDX':
+            raise RuntimeError(f'Incorrect file header - is {self.file_path} a BA2 file?')
+        if self.version not in _HEADER_EXTENSION_SIZES:
+            raise RuntimeError(f'Unknown BA2 file version: {self.version}')
+        if self.archive_type not in (GENERAL_ARCHIVE, TEXTURE_ARCHIVE):
+            raise RuntimeError(f'Unknown BA2 archive type: {self.archive_type}')
+        self._load_file_records()
+        self._load_file_names()
+        return self
+
+    def __len__(self):
+        return self.file_count
+
+    def __getitem__(self, key: Union[str, Tuple[str, ...]]) -> bytes:
+        with self._get_file_reader(*self._split_file_path(key)) as reader:
+            return reader.readall()
+
+    def __contains__(self, key: Union[str, Tuple[str, ...]]):
+        return self._get_file_index(*self._split_file_path(key)) is not None
+
+    def open(self, key: Union[str, Tuple[str, ...]]) -> io.BufferedReader:
+        """Return a read-only file object for a file in the archive.
+
+        The file is decompressed in chunks as it is read, instead of all at once. For textures,
+        the DDS header comes first, and then the mip maps, one chunk after the other.
+        """
+        return io.BufferedReader(self._get_file_reader(*self._split_file_path(key)))
+
+    @property
+    def version(self):
+        return self._header[1]
+
+    @property
+    def archive_type(self):
+        return self._header[2].decode('ascii')
+
+    @property
+    def file_count(self):
+        return self._header[3]
+
+    @property
+    def name_table_offset(self):
+        return self._header[4]
+
+    @property
+    def compression(self):
+        if self.version == 3 and struct.unpack_from('<I', self._mmap, _HEADER.size + 8)[0] == LZ4_COMPRESSION_METHOD:
+            return 'lz4_block'
+        return 'zlib'
+
+    @property
+    def file_names(self) -> Optional[List[str]]:
+        return self._file_names
+
+    @staticmethod
+    def _calculate_hash(name: str) -> int:
+        """Return the hash of a folder name or a file name without its extension: CRC-32, without the inversions."""
+        return zlib.crc32(name.encode('utf-8'), 0xffffffff) ^ 0xffffffff
+
+    @classmethod
+    def _get_key(cls, folder_name: str, file_name: str) -> Tuple[int, int, bytes]:
+        base, dot, ext = file_name.rpartition('.')
+        if not dot:
+            base, ext = file_name, ''
+        return cls._calculate_hash(folder_name), cls._calculate_hash(base), ext.encode('utf-8')[:4].ljust(4, b'\x00')
+
+    def _split_file_path(self, key: Union[str, Tuple[str, ...]]) -> Tuple[str, str]:
+        return BethesdaSoftwareArchive._split_file_path(self, key)
+
+    def _load_file_records(self):
+        """Decode the file records, once, into arrays, and index them by their hashes."""
+        self._name_hashes, self._folder_hashes = array('I'), array('I')
+        self._file_indices = {}
+        _pos = _HEADER.size + _HEADER_EXTENSION_SIZES[self.version]
+        if self.archive_type == GENERAL_ARCHIVE:
+            self._offsets, self._packed_sizes, self._original_sizes = array('Q'), array('I'), array('I')
+            file_records_end = _pos + self.file_count * _GENERAL_FILE_RECORD.size
+            for name_hash, ext, folder_hash, _, offset, packed_size, original_size, _ in \
+                    _GENERAL_FILE_RECORD.iter_unpack(self._mmap[_pos:file_records_end]):
+                self._add_file(folder_hash, name_hash, ext)
+                self._offsets.append(offset)
+                self._packed_sizes.append(packed_size)
+                self._original_sizes.append(original_size)
+            return
+
+        # Each texture has a variable number of chunks, so the records are read one by one.
+        self._textures = []
+        self._first_chunks = array('I')
+        self._chunks = []
+        for _ in range(self.file_count):
+            texture = _TEXTURE_FILE_RECORD.unpack_from(self._mmap, _pos)
+            name_hash, ext, folder_hash, _, chunk_count, chunk_header_size = texture[:6]
+            self._add_file(folder_hash, name_hash, ext)
+            self._textures.append(texture[6:])
+            _pos += _TEXTURE_FILE_RECORD.size
+            self._first_chunks.append(len(self._chunks))
+            for idx in range(chunk_count):
+                self._chunks.append(_TEXTURE_CHUNK.unpack_from(self._mmap, _pos + idx * chunk_header_size)[:3])
+            _pos += chunk_count * chunk_header_size
+        self._first_chunks.append(len(self._chunks))
+
+    def _add_file(self, folder_hash: int, name_hash: int, ext: bytes):
+        self._file_indices[folder_hash, name_hash, ext] = len(self._name_hashes)
+        self._name_hashes.append(name_hash)
+        self._folder_hashes.append(folder_hash)
+
+    def _load_file_names(self):
+        """Read the table of the full paths of the files, if the archive has one."""
+        if not self.name_table_offset:
+            self._file_names = None
+            return
+        self._file_names = []
+        _pos = self.name_table_offset
+        for _ in range(self.file_count):
+            length, = struct.unpack_from('<H', self._mmap, _pos)
+            self._file_names.append(self.path.parse(self._mmap[_pos + 2:_pos + 2 + length].decode('utf-8')))
+            _pos += 2 + length
+
+    def _get_file_index(self, folder_name: str, file_name: str) -> Optional[int]:
+        idx = self._file_indices.get(self._get_key(folder_name, file_name))
+        if idx is not None and self._file_names is not None and self._file_names[idx] != f'{folder_name}\\{file_name}':
+            return None
+        return idx
+
+    def _get_file_reader(self, folder_name: str, file_name: str) -> io.RawIOBase:
+        idx = self._get_file_index(folder_name, file_name)
+        if idx is None:
+            raise FileNotFoundError(f"The file `{file_name}` not found under the folder `{folder_name}` in the BA2 archive: {self.file_name}.")
+        if self.archive_type == GENERAL_ARCHIVE:
+            return self._get_chunk_reader(self._offsets[idx], self._packed_sizes[idx], self._original_sizes[idx])
+        readers = [io.BytesIO(self._get_dds_header(idx))]
+        for offset, packed_size, original_size in self._chunks[self._first_chunks[idx]:self._first_chunks[idx + 1]]:
+            readers.append(self._get_chunk_reader(offset, packed_size, original_size))
+        return _ConcatenatedReader(readers)
+
+    def _get_chunk_reader(self, offset: int, packed_size: int, original_size: int) -> ArchiveFileReader:
+        if not packed_size:
+            return ArchiveFileReader(self._data, offset, original_size)
+        return ArchiveFileReader(self._data, offset, packed_size, self.compression, original_size)
+
+    def _get_dds_header(self, idx: int) -> bytes:
+        """Rebuild the DDS header of a texture from its file record."""
+        height, width, mip_count, dxgi_format, is_cube_map, _ = self._textures[idx]
+        flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_MIPMAPCOUNT
+        caps = DDSCAPS_TEXTURE
+        if mip_count > 1:
+            caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+        caps2 = 0
+        if is_cube_map:
+            caps |= DDSCAPS_COMPLEX
+            caps2 = DDSCAPS2_CUBEMAP_ALL_FACES
+        dxt10_header = b''
+        if dxgi_format in _BLOCK_COMPRESSED_FORMATS:
+            four_cc, block_size = _BLOCK_COMPRESSED_FORMATS[dxgi_format]
+            flags |= DDSD_LINEARSIZE
+            pitch_or_linear_size = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+            pixel_format = (DDPF_FOURCC, int.from_bytes(four_cc or b'DX10', 'little'), 0, 0, 0, 0, 0)
+            if four_cc is None:
+                dxt10_header = _DDS_HEADER_DXT10.pack(dxgi_format, D3D10_RESOURCE_DIMENSION_TEXTURE2D,
+                                                      DDS_RESOURCE_MISC_TEXTURECUBE if is_cube_map else 0, 1, 0)
+        elif dxgi_format in _UNCOMPRESSED_FORMATS:
+            pixel_format_flags, bit_count, *masks = _UNCOMPRESSED_FORMATS[dxgi_format]
+            flags |= DDSD_PITCH
+            pitch_or_linear_size = (width * bit_count + 7) // 8
+            pixel_format = (pixel_format_flags, 0, bit_count, *masks)
+        else:
+            raise NotImplementedError(f'Rebuilding DDS headers for the DXGI format {dxgi_format} is not supported.')
+        return _DDS_HEADER.pack(b'DDS ', 124, flags, height, width, pitch_or_linear_size, 0, mip_count,
+                                32, *pixel_format, caps, caps2, 0, 0, 0) + dxt10_header
+
+
+class _ConcatenatedReader(io.RawIOBase):
+    """Read a list of file objects one after the other, as a single file."""
+
+    def __init__(self, readers: List[io.RawIOBase]):
+        self._readers = readers
+        self._idx = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._idx < len(self._readers):
+            length = self._readers[self._idx].readinto(buffer)
+            if length:
+                return length
+            self._idx += 1
+        return 0
+
+    def close(self):
+        for reader in self._readers:
+            reader.close()
+        super().close()
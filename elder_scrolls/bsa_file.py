@@ -1,11 +1,245 @@
 
+import fnmatch
+import functools
+import io
+import itertools
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+try:
+    import lz4.block
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .lib import Loader
 
 
+READ_CHUNK_SIZE = 64 * 1024
+
+# Set in the size of a file record when the file is compressed differently from the archive default.
+COMPRESSION_TOGGLE_BIT = 0x40000000
+
+# file ID, version, offset, archive flags, folder count, file count,
+# total folder name length, total file name length, file flags, padding
+_HEADER = struct.Struct('<4sIIIIIIIHH')
+# hash, file count, (unknown,) offset
+_FOLDER_RECORDS = {104: struct.Struct('<QII'), 105: struct.Struct('<QIIQ')}
+# hash, size, offset
+_FILE_RECORD = struct.Struct('<QII')
+
+HASH_CACHE_SIZE = 65536
+_HASH_EXTENSION_BITS = {'.kf': 0x80, '.nif': 0x8000, '.dds': 0x8080, '.wav': 0x80000000}
+_UINT = 0xffffffff
+_HASH_MULTIPLIER = 0x1003F
+
+
+def hash_paths(paths: Iterable[str]) -> Tuple[Union['np.ndarray', array], Union['np.ndarray', array]]:
+    """Return the folder hashes and the file hashes of many paths at once, as two columns.
+
+    Paths are separated by slashes or backslashes, for example 'textures/sky/stars.dds'.
+    The columns are uint64 NumPy arrays if NumPy is installed, `array('Q')` otherwise.
+    Look files up with `(folder_hashes[i], file_hashes[i])` instead of hashing each path on its own.
+    """
+    paths = list(paths)
+    if paths:
+        # Paths do not contain null characters, so all of them are parsed at once.
+        paths = BethesdaSoftwareArchive.path.parse('\x00'.join(paths)).split('\x00')
+    if np is None:
+        split_paths = [path.strip('\\').rpartition('\\') for path in paths]
+        return (array('Q', (BethesdaSoftwareArchive._calculate_hash(folder_name) for folder_name, _, _ in split_paths)),
+                array('Q', (BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True)
+                            for _, _, file_name in split_paths)))
+
+    chars, lengths = _to_char_matrix(paths)
+    columns = np.arange(chars.shape[1])
+    is_separator = chars == ord('\\')
+    # The parts of the paths between the leading and trailing separators, as with str.strip.
+    is_part = ~is_separator & (columns < lengths[:, None])
+    has_part = is_part.any(axis=1)
+    starts = np.where(has_part, is_part.argmax(axis=1), 0)
+    ends = np.where(has_part, chars.shape[1] - is_part[:, ::-1].argmax(axis=1), 0)
+    is_separator &= (columns >= starts[:, None]) & (columns < ends[:, None])
+    separators = np.where(is_separator.any(axis=1), chars.shape[1] - 1 - is_separator[:, ::-1].argmax(axis=1),
+                          starts - 1)
+    folder_hashes = _hash_chars(chars, starts, np.maximum(separators - starts, 0), is_file=False)
+    file_hashes = _hash_chars(chars, separators + 1, ends - separators - 1, is_file=True)
+    return folder_hashes, file_hashes
+
+
+def _hash_chars(chars, starts, lengths, is_file):
+    """Return the hashes of the names at `starts` with the `lengths` in the rows of a character matrix.
+
+    The hashes are the same as from `_calculate_hash`, computed for every row at once.
+    """
+    rows = np.arange(len(lengths))
+    if is_file:
+        # Same as os.path.splitext: the extension starts at the last dot, unless there are only dots before it.
+        columns = np.arange(chars.shape[1])
+        is_dot = chars == ord('.')
+        is_in_name = (columns >= starts[:, None]) & (columns < (starts + lengths)[:, None])
+        dots = is_dot & is_in_name
+        others = ~is_dot & is_in_name
+        last_dots = np.where(dots.any(axis=1), chars.shape[1] - 1 - dots[:, ::-1].argmax(axis=1), -1)
+        first_others = np.where(others.any(axis=1), others.argmax(axis=1), starts + lengths)
+        base_lengths = np.where((last_dots >= 0) & (first_others < last_dots), last_dots - starts, lengths)
+    else:
+        base_lengths = lengths
+    ext_starts, ext_lengths = starts + base_lengths, lengths - base_lengths
+
+    # Characters are read from the flattened matrix. Positions past the end of a name may read the next
+    # row, but these characters are always masked out below.
+    flat_chars, row_starts = chars.ravel(), rows * chars.shape[1]
+
+    def get_chars(positions):
+        return flat_chars.take(row_starts + positions, mode='clip')
+
+    hash1 = get_chars(starts + base_lengths - 1).astype(np.uint64)
+    hash1 |= np.where(base_lengths > 2, get_chars(starts + base_lengths - 2), 0).astype(np.uint64) << np.uint64(8)
+    hash1 |= base_lengths.astype(np.uint64) << np.uint64(16)
+    hash1 |= get_chars(starts).astype(np.uint64) << np.uint64(24)
+    for ext, bits in _HASH_EXTENSION_BITS.items():
+        is_ext = ext_lengths == len(ext)
+        for idx, char in enumerate(ext):
+            is_ext &= get_chars(ext_starts + idx) == ord(char)
+        hash1[is_ext] |= np.uint64(bits)
+
+    # Both sums run over every name at once, one character position at a time.
+    hash2 = _sum_chars(get_chars, starts + 1, base_lengths - 3)
+    hash3 = _sum_chars(get_chars, ext_starts, ext_lengths)
+    hash2 = (hash2 + hash3) & np.uint64(_UINT)
+    # Empty names, such as the folder of files in the root of the archive, have the hash 0.
+    return np.where(lengths > 0, (hash2 << np.uint64(32)) + hash1, np.uint64(0))
+
+
+def _split_name(name, is_file):
+    """File names are hashed separately from their extensions, folder names are hashed whole."""
+    name = name.lower()
+    if is_file:
+        # Same as os.path.splitext, for a name without separators.
+        base, dot, ext = name.rpartition('.')
+        if base.strip('.'):
+            return base, dot + ext
+    return name, ''
+
+
+def _to_char_matrix(strings):
+    """Return the characters of the strings as rows of a zero-padded matrix, and the lengths of the strings."""
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    chars = np.zeros((len(strings), max(int(lengths.max(initial=0)), 1)), dtype=np.uint32)
+    chars[np.arange(chars.shape[1]) < lengths[:, None]] = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+    return chars, lengths
+
+
+def _sum_chars(get_chars, starts, counts):
+    """Return the sums of `counts` characters from `starts` in every row, as in the second part of the hash."""
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for idx in range(int(counts.max(initial=0))):
+        updated = (hashes * np.uint64(_HASH_MULTIPLIER) + get_chars(starts + idx)) & np.uint64(_UINT)
+        hashes = np.where(idx < counts, updated, hashes)
+    return hashes
+
+
+class ArchiveFileReader(io.RawIOBase):
+    """Read a file stored in an archive, decompressing it chunk by chunk as it is read.
+
+    `compression` is None for files that are stored as they are, 'zlib', 'lz4' for LZ4 frames,
+    or 'lz4_block' for LZ4 blocks, which also need the `original_size` of the file.
+    Wrap it in `io.BufferedReader` to read lines or small pieces efficiently.
+    """
+
+    def __init__(self, data, start: int, size: int, compression: Optional[str]=None,
+                 original_size: Optional[int]=None):
+        self._data = data
+        self._pos = start
+        self._end = start + size
+        self._compression = compression
+        if compression == 'zlib':
+            self._decompressor = zlib.decompressobj()
+        elif compression in ('lz4', 'lz4_block'):
+            if lz4 is None:
+                raise ImportError('Reading LZ4 compressed files requires the lz4 package: pip install lz4')
+            if compression == 'lz4':
+                self._decompressor = lz4.frame.LZ4FrameDecompressor()
+            else:
+                self._decompressor = _LZ4BlockDecompressor(size, original_size)
+        elif compression is not None:
+            raise ValueError(f'Unknown compression: {compression}')
+        self._pending = b''
+        self._pending_pos = 0
+        self._is_started = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._compression is None:
+            length = min(len(buffer), self._end - self._pos)
+            buffer[:length] = self._data[self._pos:self._pos + length]
+            self._pos += length
+            return length
+        self._is_started = True
+        while self._pending_pos == len(self._pending) and self._pos < self._end:
+            chunk = self._data[self._pos:min(self._pos + READ_CHUNK_SIZE, self._end)]
+            self._pos += len(chunk)
+            self._pending = self._decompressor.decompress(chunk)
+            self._pending_pos = 0
+        length = min(len(buffer), len(self._pending) - self._pending_pos)
+        buffer[:length] = self._pending[self._pending_pos:self._pending_pos + length]
+        self._pending_pos += length
+        return length
+
+    def readall(self) -> bytes:
+        """Read the rest of the file. If nothing has been read yet, it is decompressed in one call."""
+        if self._is_started:
+            return super().readall()
+        content = self._data[self._pos:self._end]
+        self._pos = self._end
+        if self._compression is None:
+            return bytes(content)
+        self._is_started = True
+        return self._decompressor.decompress(content)
+
+
+class _LZ4BlockDecompressor:
+    """An LZ4 block cannot be decompressed in pieces, so collect it and decompress it at the end."""
+
+    def __init__(self, size: int, original_size: int):
+        self._pieces = []
+        self._remaining = size
+        self._original_size = original_size
+
+    def decompress(self, data) -> bytes:
+        self._pieces.append(bytes(data))
+        self._remaining -= len(data)
+        if self._remaining > 0:
+            return b''
+        return lz4.block.decompress(b''.join(self._pieces), uncompressed_size=self._original_size)
+
+
 class BethesdaSoftwareArchive(Loader):
-    """Parse a v104/105 (Skyrim) BSA File."""
+    """Parse a v104/105 (Skyrim) BSA File.
+
+    Usage example:
 
-    file_record_length = 16
+    with BethesdaSoftwareArchive(os.path.join(game_folder, 'Data', 'Skyrim - Interface.bsa')) as archive:
+        strings = archive['Strings', 'Skyrim_english.strings']  # The content of a file, decompressed.
+        with archive.open('Interface\\fontconfig.txt') as font_config:  # A file object, read in chunks.
+            print(font_config.readline())
+    """
+
+    file_record_length = _FILE_RECORD.size
 
     class path:
         @staticmethod
@@ -25,26 +259,24 @@ class BethesdaSoftwareArchive(Loader):
             return not super().is_folder_path(path_string)
 
     class Folder:
-        def __init__(self, folder_index, folder_name, folder_record):
-            folder_hash = BethesdaSoftwareArchive._calculate_hash(folder_name)
-            if folder_hash != folder_record['hash']:
-                raise ValueError(f'Folder name {folder_name} resolves to the hash {folder_hash}, '
-                                 f'but the hash in the folder record is {folder_record["hash"]}')
-            self.name = folder_name
+        """A folder in the archive. The names and the records of its files are read when they are used."""
+        def __init__(self, archive, folder_index):
+            self._archive = archive
             self.index = folder_index
-            self._hash = folder_record['hash']
-            self._file_count = folder_record['file_count']
-            self._offset = folder_record['offset']
+            self.name = archive._folder_names[folder_index]
+            self._hash = archive._folder_hashes[folder_index]
+            self._first_file = archive._folder_first_files[folder_index]
+            self._file_count = archive._folder_file_counts[folder_index]
+            if self.name is not None and BethesdaSoftwareArchive._calculate_hash(self.name) != self._hash:
+                raise ValueError(f'Folder name {self.name} resolves to the hash '
+                                 f'{BethesdaSoftwareArchive._calculate_hash(self.name)}, '
+                                 f'but the hash in the folder record is {self._hash}')
 
         def __len__(self):
             return self._file_count
 
         def __repr__(self):
-            return {
-                'hash': self._hash,
-                'file_count': self._file_count,
-                'offset': self._offset
-            }
+            return repr(self.record)
 
         def __int__(self):
             return self._hash
@@ -53,40 +285,93 @@ class BethesdaSoftwareArchive(Loader):
             return self.name
 
         def __iter__(self):
-            for file_name in self._file_names:
-                yield file_name
+            for idx in range(self._first_file, self._first_file + self._file_count):
+                yield self._archive._get_file_name(idx)
 
         def __contains__(self, item):
             if isinstance(item, str):
-                return item.lower() in self._file_names
+                return self._archive._find_file_record(self._hash, item) is not None
             else:
                 raise TypeError(f'BSA folder contains filenames only. Expected: string. Got: {type(item)}')
 
-        # TODO: __getitem__
+        def __getitem__(self, key: Union[str, int]) -> 'BethesdaSoftwareArchive.File':
+            """Return a file in the folder, by its name or by its position in the folder."""
+            if isinstance(key, str):
+                idx = self._archive._find_file_record(self._hash, key)
+                if idx is None:
+                    raise FileNotFoundError(f"The file `{key}` not found under the folder `{self.name}` "
+                                            f"in the BSA archive: {self._archive.file_name}.")
+            elif isinstance(key, int):
+                if not -self._file_count <= key < self._file_count:
+                    raise IndexError(f'The folder `{self.name}` has {self._file_count} files.')
+                idx = self._first_file + key % self._file_count
+            else:
+                raise TypeError(f'BSA folder files are found by name or position. Expected: string or int. Got: {type(key)}')
+            return BethesdaSoftwareArchive.File(self._archive, idx)
 
         @property
         def record(self):
             return {
                 'hash': self._hash,
                 'file_count': self._file_count,
-                'offset': self._offset
+                'offset': self._archive._folder_offsets[self.index]
             }
 
-    def __enter__(self):
-        self._file = open(self.file_path, 'rb')
+    class File:
+        """A file in the archive. Nothing is read or decompressed until it is opened."""
+        __slots__ = ('_archive', 'index')
+
+        def __init__(self, archive, file_index):
+            self._archive = archive
+            self.index = file_index
+
+        def __repr__(self):
+            return f'<{self.__class__.__name__} {self.name!r} in {self._archive.file_name}>'
+
+        @property
+        def name(self) -> Optional[str]:
+            return self._archive._get_file_name(self.index)
+
+        @property
+        def record(self):
+            return self._archive._read_file_record(self.index)
+
+        @property
+        def size(self) -> int:
+            """The size of the file in the archive, compressed or not."""
+            return self.record['size']
+
+        @property
+        def is_compressed(self) -> bool:
+            return self.record['is_compressed']
+
+        def open(self) -> io.BufferedReader:
+            return io.BufferedReader(self._archive._get_file_reader_by_record(self.record))
+
+        def read(self) -> bytes:
+            with self._archive._get_file_reader_by_record(self.record) as reader:
+                return reader.readall()
+
+        def view(self) -> memoryview:
+            """Return the content as a memoryview, which is a slice of the archive if the file is not compressed."""
+            return self._archive._view_file_record(self.record)
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
         try:
-            assert self._read_bytes(0, 4) == b'BSA\x00'
-        except AssertionError:
+            self._header = _HEADER.unpack_from(self._mmap)
+        except struct.error:
             raise RuntimeError(f'Incorrect file header - is {self.file_path} a BSA file?')
+        # Files are read by slicing this view, without copies and without moving the position of the mmap.
+        self._data = memoryview(self._mmap)
 
-        if self.version == 104:
-            self.folder_record_length = 16
-        elif self.version == 105:
-            self.folder_record_length = 24
-        else:
+    def __enter__(self):
+        if self._header[0] != b'BSA\x00':
+            raise RuntimeError(f'Incorrect file header - is {self.file_path} a BSA file?')
+        if self.version not in _FOLDER_RECORDS:
             raise RuntimeError(f'Unknown BSA file version: {self.version}')
-        self._load_folder_records()
-        self._load_folder_filenames()
+        self.folder_record_length = _FOLDER_RECORDS[self.version].size
+        self._load_directory()
         # TODO: Add __len__
         # TODO: Add __iter__ ?
         return self
@@ -99,256 +384,356 @@ class BethesdaSoftwareArchive(Loader):
             if key.step is not None:
                 raise KeyError(f'{self.__class__.__name__} does not allow slicing '
                                 'with a step. Use only one colon in slice, for example: [0:4]')
-            return self._read_bytes(key.start, key.stop - key.start)
+            return self._data[key.start:key.stop]
         elif isinstance(key, tuple):
-            if len(key) >= 2 and [isinstance(key_part, str) for key_part in key]:
-                return self._read_file_by_name(self.path.parse(key[0]), self.path.parse('\\'.join(key[1:])))
-            else:
-                raise KeyError(f"{self.__class__.__name__} allows tuple of two strings to return "
-                                "a file by folder and file name. Example: ['Strings', 'Skyrim_en.dlstrings']")
+            return self._read_file_by_name(*self._split_file_path(key))
         elif isinstance(key, str):
-            if '.' in key:
-                key = key.replace('/', '\\').split('\\')
-                return self._read_file_by_name(self.path.parse(key[0]), self.path.parse('\\'.join(key[1:])))
-            else:
-                return self._get_folder(self.path.parse(key))
+            path = self.path.parse(key).strip('\\')
+            if '.' not in key or self._calculate_hash(path) in self._folder_indices:
+                return self._get_folder(path)
+            return self._read_file_by_name(*self._split_file_path(path))
         elif isinstance(key, int):
             return self._get_folder_by_hash(key)
         else:
             raise KeyError
 
     def __contains__(self, key):
-        if isinstance(key, tuple):
-            if len(key) >= 2 and [isinstance(key_part, str) for key_part in key]:
-                return bool(self._get_file_index(self.path.parse(key[0]), self.path.parse('\\'.join(key[1:]))))
-            else:
-                raise KeyError(f"{self.__class__.__name__} allows tuple of two strings to return "
-                                "a file by folder and file name. Example: ['Strings', 'Skyrim_en.dlstrings']")
         if isinstance(key, int):
-            return key in self._folders
+            return key in self._folder_indices
+        elif isinstance(key, tuple):
+            return self._get_file_record_index(*self._split_file_path(key)) is not None
         elif isinstance(key, str):
-            hash = self._calculate_hash(self.path.parse(key))
-            return hash in self._folders
-            # TODO: Add files and full paths.
+            path = self.path.parse(key).strip('\\')
+            if self._calculate_hash(path) in self._folder_indices:
+                return True
+            return self._get_file_record_index(*self._split_file_path(path)) is not None
         else:
             raise NotImplementedError
 
-    def _load_folder_records(self):
-        self._folders = {}
-        for idx in range(self.folder_count):
-            folder_name = self._get_folder_name_by_index(idx)
-            folder_record = self._get_folder_record_by_index(idx)
-            self._folders[folder_record['hash']] = self.Folder(idx, folder_name, folder_record)
-
-    def _load_folder_filenames(self):
-        file_names = self._get_file_names()
-        self._folder_filenames = {}
-        i = 0
-        for folder_hash in self._folders:
-            self._folders[folder_hash]._file_names = []
-            while len(self._folders[folder_hash]._file_names) < self._folders[folder_hash]._file_count:
-                self._folders[folder_hash]._file_names += [file_names[i]]
-                i += 1
-        if i != len(file_names):
-            raise RuntimeError(f"Following files are not in a folder: {file_names[i:]}")
-
-    def _get_file_index(self, folder_name, file_name):
-        folder_hash = self._calculate_hash(folder_name)
-        try:
-            return self._folders[folder_hash]._file_names.index(file_name.lower())
-        except ValueError:
-            raise FileNotFoundError(f"The file `{file_name}` not found under the folder `{folder_name}` in the BSA archive: {self.file_name}.")
+    def open(self, key: Union[str, Tuple[str, ...]]) -> io.BufferedReader:
+        """Return a read-only file object for a file in the archive.
+
+        The file is decompressed in chunks as it is read, instead of all at once.
+        The key is a path, or a tuple of a folder and a file name, as for `archive[key]`.
+        """
+        return io.BufferedReader(self._get_file_reader(*self._split_file_path(key)))
+
+    def view(self, key: Union[str, Tuple[str, ...]]) -> memoryview:
+        """Return the content of a file in the archive as a memoryview.
+
+        Files that are not compressed are not copied: the view is a slice of the memory map of the
+        archive, so many threads can serve files from one archive at once, without locks or copies.
+        Compressed files are decompressed into a new buffer.
+        """
+        return self._view_file_record(self._get_file_record_by_name(*self._split_file_path(key)))
+
+    def extract_all(self, dest: str, workers: Optional[int]=None, filter: Optional[str]=None) -> Dict[str, float]:
+        """Extract the files in the archive under the folder `dest`, and return the count, size and speed.
+
+        `filter` is a glob pattern for the paths to extract, for example 'textures/*.dds'.
+        The files are read in the order of their data in the archive, so that the reads are sequential,
+        and decompressed and written in `workers` threads. zlib and lz4 release the GIL while working.
+        """
+        if not self.has_file_names or not self.has_folder_names:
+            raise RuntimeError(f'The BSA archive {self.file_name} does not have the folder and file names to extract to.')
+        if filter is not None:
+            filter = self.path.parse(filter)
+        file_records = []
+        for folder_idx, folder_name in enumerate(self._folder_names):
+            first_file = self._folder_first_files[folder_idx]
+            for idx in range(first_file, first_file + self._folder_file_counts[folder_idx]):
+                path = f'{folder_name}\\{self._get_file_name(idx)}'
+                if filter is None or fnmatch.fnmatchcase(path, filter):
+                    file_records.append((self._file_offsets[idx], path, idx))
+        file_records.sort()
+        # Every path is checked before anything is written, so that a crafted archive extracts nothing.
+        dest = os.path.realpath(dest)
+        file_paths = [self._get_extraction_path(dest, path) for _, path, _ in file_records]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sizes = list(executor.map(self._extract_file, file_paths, [idx for _, _, idx in file_records]))
+        seconds = time.perf_counter() - start
+        size = sum(sizes)
+        return {
+            'file_count': len(file_records),
+            'size': size,
+            'seconds': seconds,
+            'mb_per_second': size / 2 ** 20 / seconds if seconds else 0.0,
+        }
+
+    def _get_extraction_path(self, dest: str, path: str) -> str:
+        """Return the path to extract a file to, or raise an error if it would be outside of `dest`.
+
+        The names in an archive are not trusted: absolute paths, drive letters and paths that lead out of
+        `dest` with '..' are rejected.
+        """
+        parts = path.replace('/', '\\').split('\\')
+        if not parts[0] or any(':' in part for part in parts) or os.path.isabs(path):
+            raise RuntimeError(f'The path {path} in {self.file_name} is not relative to the folder to extract to.')
+        file_path = os.path.realpath(os.path.join(dest, *parts))
+        if os.path.commonpath([dest, file_path]) != dest or file_path == dest:
+            raise RuntimeError(f'The path {path} in {self.file_name} is outside of the folder to extract to.')
+        return file_path
+
+    def _extract_file(self, file_path: str, idx: int) -> int:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with self._get_file_reader_by_record(self._read_file_record(idx)) as reader:
+            content = reader.readall()
+        with open(file_path, 'wb') as extracted_file:
+            extracted_file.write(content)
+        return len(content)
+
+    def _split_file_path(self, key: Union[str, Tuple[str, ...]]) -> Tuple[str, str]:
+        """Return the folder and the file name in a path, or in a tuple of path parts."""
+        if isinstance(key, tuple):
+            if len(key) < 2 or not all(isinstance(key_part, str) for key_part in key):
+                raise KeyError(f"{self.__class__.__name__} allows tuple of two strings to return "
+                                "a file by folder and file name. Example: ['Strings', 'Skyrim_en.dlstrings']")
+            key = '\\'.join(key)
+        folder_name, _, file_name = self.path.parse(key).strip('\\').rpartition('\\')
+        return folder_name, file_name
+
+    def _load_directory(self):
+        """Decode the folder records and the file records, once, into arrays.
+
+        The file names and the index of the file records by their hashes are loaded when they are first used.
+        """
+        folder_record = _FOLDER_RECORDS[self.version]
+        folder_records_end = self.offset + self.folder_count * self.folder_record_length
+        folder_records = folder_record.iter_unpack(self._mmap[self.offset:folder_records_end])
+        self._folder_hashes, self._folder_file_counts, self._folder_offsets = array('Q'), array('I'), array('Q')
+        for folder_hash, file_count, *_, offset in folder_records:
+            self._folder_hashes.append(folder_hash)
+            self._folder_file_counts.append(file_count)
+            self._folder_offsets.append(offset)
+        self._folder_indices = dict(zip(self._folder_hashes, range(self.folder_count)))
+
+        self._folder_names = []
+        self._folder_first_files = array('I')
+        self._file_hashes, self._file_sizes, self._file_offsets = array('Q'), array('I'), array('I')
+        _pos = folder_records_end
+        for offset, file_count in zip(self._folder_offsets, self._folder_file_counts):
+            _pos = offset - self.total_file_name_length
+            if self.has_folder_names:
+                name_length = self._mmap[_pos]
+                self._folder_names.append(self._mmap[_pos + 1:_pos + name_length].decode('utf-8'))
+                _pos += 1 + name_length
+            else:
+                self._folder_names.append(None)
+            self._folder_first_files.append(len(self._file_hashes))
+            file_records_end = _pos + file_count * self.file_record_length
+            # Each file record is a 64-bit hash, followed by the 32-bit size and offset.
+            file_records = self._mmap[_pos:file_records_end]
+            hashes, words = array('Q', file_records), array('I', file_records)
+            if sys.byteorder == 'big':
+                hashes.byteswap()
+                words.byteswap()
+            self._file_hashes.extend(hashes[::2])
+            self._file_sizes.extend(words[2::4])
+            self._file_offsets.extend(words[3::4])
+            _pos = file_records_end
+
+        if len(self._file_hashes) != self.file_count:
+            raise RuntimeError(f"File count in the header is {self.file_count} but the folders have {len(self._file_hashes)}")
+        self._file_names_offset = _pos
+        self._file_name_offsets = None
+        self._file_record_indices = None
+
+    def _get_file_name(self, idx: int) -> Optional[str]:
+        """Return the name of a file, or None if the archive does not have file names."""
+        if not self.has_file_names:
+            return None
+        if self._file_name_offsets is None:
+            file_names = self._mmap[self._file_names_offset:self._file_names_offset + self.total_file_name_length]
+            file_name_offsets = array('I', [0])
+            file_name_offsets.extend(itertools.accumulate(len(file_name) + 1
+                                                          for file_name in file_names.split(b'\x00')[:-1]))
+            if len(file_name_offsets) != self.file_count + 1:
+                raise RuntimeError(f"File count in the header is {self.file_count} but the list of file names is {len(file_name_offsets) - 1}")
+            # Other threads may be reading file names: the offsets are shared only once they are complete.
+            self._file_name_offsets = file_name_offsets
+        start = self._file_names_offset + self._file_name_offsets[idx]
+        end = self._file_names_offset + self._file_name_offsets[idx + 1] - 1
+        return self._mmap[start:end].decode('utf-8')
+
+    def _get_file_record_indices(self):
+        """Return the index of each file record, by (folder hash, file hash)."""
+        if self._file_record_indices is None:
+            folder_hashes = itertools.chain.from_iterable(map(itertools.repeat, self._folder_hashes, self._folder_file_counts))
+            self._file_record_indices = dict(zip(zip(folder_hashes, self._file_hashes), range(self.file_count)))
+        return self._file_record_indices
+
+    def _get_file_record_index(self, folder_name, file_name):
+        """Return the index of the file record for a folder and a file name, or None if there is no such file."""
+        return self._find_file_record(self._calculate_hash(folder_name), file_name)
+
+    def _find_file_record(self, folder_hash, file_name):
+        file_name = file_name.lower()
+        idx = self._get_file_record_indices().get((folder_hash, self._calculate_hash(file_name, is_file=True)))
+        if idx is not None and self.has_file_names and self._get_file_name(idx) != file_name:
+            return None
+        return idx
 
     def _read_file_by_name(self, folder_name, file_name):
-        file_record = self._get_file_record_by_name(folder_name, file_name)
+        with self._get_file_reader(folder_name, file_name) as reader:
+            return reader.readall()
+
+    def _get_file_reader(self, folder_name, file_name) -> ArchiveFileReader:
+        return self._get_file_reader_by_record(self._get_file_record_by_name(folder_name, file_name))
+
+    def _get_file_reader_by_record(self, file_record) -> ArchiveFileReader:
+        file_offset, file_size = self._get_file_data_range(file_record)
+        if not file_record['is_compressed']:
+            return ArchiveFileReader(self._data, file_offset, file_size)
+        # Compressed files start with their original size.
+        return ArchiveFileReader(self._data, file_offset + 4, file_size - 4,
+                                 'lz4' if self.version >= 105 else 'zlib')
+
+    def _view_file_record(self, file_record) -> memoryview:
+        if file_record['is_compressed']:
+            with self._get_file_reader_by_record(file_record) as reader:
+                return memoryview(reader.readall())
+        file_offset, file_size = self._get_file_data_range(file_record)
+        return self._data[file_offset:file_offset + file_size]
+
+    def _get_file_data_range(self, file_record) -> Tuple[int, int]:
+        """Return the offset and the size of the data of a file, after its name if the names are embedded."""
         file_offset = file_record['offset']
         file_size = file_record['size']
-        print(self[file_offset - 12:file_offset], self[file_offset:file_offset + 12])
         if self.are_file_names_embedded:
-            raise NotImplementedError
-        if file_record['is_compressed']:
-            raise NotImplementedError
-        return self[file_offset:file_offset + file_size]
-
-
-    @staticmethod
-    def _get_bit(longword: bytes, bit: int):
-        try:
-            return bool(int.from_bytes(longword, 'little', signed=False) & 2 ** bit)
-        except TypeError:
-            if longword is None:
-                return None
+            name_length = self._data[file_offset] + 1
+            file_offset += name_length
+            file_size -= name_length
+        return file_offset, file_size
 
     def _get_folder_record_by_index(self, idx):
-        _pos = self.offset + idx * self.folder_record_length
-        _bytes = self[_pos:_pos + self.folder_record_length]
-        _pos_for_offset = 16 if self.version >= 105 else 12
         return {
-            'hash': int.from_bytes(_bytes[0:8], 'little', signed=False),
-            'file_count': int.from_bytes(_bytes[8:12], 'little', signed=False),
-            'offset': int.from_bytes(_bytes[_pos_for_offset:_pos_for_offset + 4], 'little', signed=False),
+            'hash': self._folder_hashes[idx],
+            'file_count': self._folder_file_counts[idx],
+            'offset': self._folder_offsets[idx],
         }
 
     def _get_folder_name_by_index(self, idx):
-        offset = self._get_folder_record_by_index(idx)['offset']
-        return self._read_string(offset - self.total_file_name_length + 1)
-
-    def _get_file_names(self):
-        last_folder_index = self.folder_count - 1
-        last_folder_offset = self._get_folder_record_by_index(last_folder_index)['offset']
-        last_folder_file_count = self._get_folder_record_by_index(last_folder_index)['file_count']
-        file_count = 0
-        for idx in range(self.folder_count):
-            file_count += self._get_folder_record_by_index(idx)['file_count']
-        last_folder_name = self._read_string(last_folder_offset - self.total_file_name_length + 1)
-        file_name_list_offset = last_folder_offset - self.total_file_name_length + 1 + len(last_folder_name) + 1 + last_folder_file_count * self.file_record_length
-        file_names = []
-        while len(file_names) < file_count:
-            file_name = self._read_string(file_name_list_offset)
-            file_name_list_offset += len(file_name) + 1
-            file_names += [file_name]
-        if len(file_names) != self.file_count:
-            raise RuntimeError(f"File count in the header is {self.file_count} but the list of file names is {len(file_names)}")
-        return file_names
-
-    # def _get_files_in_folder_by_index(self, folder_idx):
-    #     folder_record = self._get_folder_record_by_index(folder_idx)
-    #     file_count = folder_record['file_count']
-    #     for file_idx in range(file_count):
-    #         yield self._read_file_record_by_index(folder_idx, file_idx)
-
-    def _read_file_record_bytes(self, folder_idx):
-        folder_offset = self._get_folder_record_by_index(folder_idx)['offset']
-        folder_name = self._read_string(folder_offset - self.total_file_name_length + 1)
-        file_count = self._get_folder_record_by_index(folder_idx)['file_count']
-        file_offset = folder_offset - self.total_file_name_length + 1 + len(folder_name) + 1 + file_count * self.file_record_length
-        _bytes = self[file_offset:file_offset + self.file_record_length]
-        return _bytes
-
-    def _read_file_record_bytes_by_index(self, folder_idx, file_idx):
-        folder_offset = self._get_folder_record_by_index(folder_idx)['offset']
-        folder_name = self._read_string(folder_offset - self.total_file_name_length + 1)
-        file_offset = folder_offset - self.total_file_name_length + 1 + len(folder_name) + 1 + file_idx * self.file_record_length
-        _bytes = self[file_offset:file_offset + self.file_record_length]
-        assert len(_bytes) == 16
-        return _bytes
+        return self._folder_names[idx]
 
     def _read_file_record_by_index(self, folder_idx, file_idx):
-        _bytes = self._read_file_record_bytes_by_index(folder_idx, file_idx)
+        return self._read_file_record(self._folder_first_files[folder_idx] + file_idx)
+
+    def _read_file_record(self, idx):
+        size = self._file_sizes[idx]
         return {
-            'hash': int.from_bytes(_bytes[0:8], 'little', signed=False),
-            'size': int.from_bytes(_bytes[8:12], 'little', signed=False),
-            'is_compressed': self._get_bit(_bytes[8:12], 29) ^ self.is_compressed_by_default,
-            'offset': int.from_bytes(_bytes[12:16], 'little', signed=False),
+            'hash': self._file_hashes[idx],
+            'size': size & ~COMPRESSION_TOGGLE_BIT,
+            'is_compressed': bool(size & COMPRESSION_TOGGLE_BIT) ^ self.is_compressed_by_default,
+            'offset': self._file_offsets[idx],
         }
 
     def _get_file_record_by_name(self, folder_name, file_name):
-        folder = self[folder_name]
-        file_idx = self._get_file_index(folder_name, file_name)
-        file_record = self._read_file_record_by_index(folder.index, file_idx)
-        return file_record
+        idx = self._get_file_record_index(folder_name, file_name)
+        if idx is None:
+            folder = self._get_folder(folder_name)
+            raise FileNotFoundError(f"The file `{file_name}` not found under the folder `{folder}` in the BSA archive: {self.file_name}.")
+        return self._read_file_record(idx)
 
     @property
     def folders(self):
-        return list(self._folders.values())
+        return [self.Folder(self, idx) for idx in range(self.folder_count)]
 
     @property
     def folder_names(self):
-        return [folder.name for folder in self._folders.values()]
+        return list(self._folder_names)
 
     @staticmethod
-    def _calculate_hash(path):
+    @functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+    def _calculate_hash(path, is_file=False):
         """Returns tes4's two hash values for filename.
 
         Based on the code found at: https://en.uesp.net/wiki/Oblivion_Mod:Hash_Calculation
 
         In turn, based on TimeSlips code with cleanup and pythonization.
+
+        The results are cached. Use `hash_paths` to hash many paths at once.
         """
-        extensions = {'.kf': 0x80, '.nif': 0x8000, '.dds': 0x8080, '.wav': 0x80000000}
-        path = path.lower()
-        if any([path.endswith(ext) for ext in extensions]):
-            ext = '.' + path.lower().split('.')[-1]
-            base = path[:-len(ext)]
-        else:
-            ext = ''
-            base = path
+        base, ext = _split_name(path, is_file)
 
         chars = list(map(ord, base))
+        if not chars:
+            # The folder name of files in the root of the archive, which has no folder record.
+            return 0
         hash1 = chars[-1] | (chars[-2] if len(chars) > 2 else 0) << 8 | len(chars) << 16 | chars[0] << 24
-        if ext in extensions:
-            hash1 |= extensions[ext]
+        hash1 |= _HASH_EXTENSION_BITS.get(ext, 0)
 
-        uint, hash2, hash3 = 0xffffffff, 0 , 0
+        hash2, hash3 = 0, 0
         for char in chars[1:-2]:
-            hash2 = ((hash2 * 0x1003F) + char ) & uint
+            hash2 = ((hash2 * _HASH_MULTIPLIER) + char) & _UINT
 
         for char in ext:
-            hash3 = ((hash3 * 0x1003F) + ord(char)) & uint
+            hash3 = ((hash3 * _HASH_MULTIPLIER) + ord(char)) & _UINT
 
-        hash2 = (hash2 + hash3) & uint
+        hash2 = (hash2 + hash3) & _UINT
 
         return (hash2<<32) + hash1
 
 
     def _get_folder_by_hash(self, hash):
-        return self._folders.get(hash)
+        idx = self._folder_indices.get(hash)
+        return None if idx is None else self.Folder(self, idx)
 
 
     def _get_folder(self, folder_name):
         folder_name = folder_name.lower()
         folder_name = folder_name.strip('\\')
         hash = self._calculate_hash(folder_name)
-        if hash not in self._folders:
+        if hash not in self._folder_indices:
             raise FileNotFoundError(f'Folder `{folder_name}` not found in the BSA archive: {self.file_name}')
         return self._get_folder_by_hash(hash)
 
 
     @property
     def version(self):
-        return int.from_bytes(self[4:8], 'little', signed=False)
+        return self._header[1]
 
     @property
     def offset(self):
-        return int.from_bytes(self[8:12], 'little', signed=False)
+        return self._header[2]
 
     @property
     def folder_count(self):
-        return int.from_bytes(self[16:20], 'little', signed=False)
+        return self._header[4]
 
     @property
     def file_count(self):
-        return int.from_bytes(self[20:24], 'little', signed=False)
+        return self._header[5]
 
     @property
     def total_folder_name_length(self):
-        return int.from_bytes(self[24:28], 'little', signed=False)
+        return self._header[6]
 
     @property
     def total_file_name_length(self):
-        return int.from_bytes(self[28:32], 'little', signed=False)
+        return self._header[7]
 
     @property
     def has_folder_names(self):
-        return self._get_bit(self[12:16], 0)
+        return bool(self._header[3] & 0x1)
 
     @property
     def has_file_names(self):
-        return self._get_bit(self[12:16], 1)
+        return bool(self._header[3] & 0x2)
 
     @property
     def is_compressed_by_default(self):
-        return self._get_bit(self[12:16], 2)
+        return bool(self._header[3] & 0x4)
 
     @property
     def are_file_names_embedded(self):
-        return self._get_bit(self[12:16], 8)
+        return bool(self._header[3] & 0x100)
 
     @property
     def contains_meshes(self):
-        return self._get_bit(self[30:32], 0)
+        return bool(self._header[8] & 0x1)
 
     @property
     def contains_textures(self):
-        return self._get_bit(self[30:32], 1)
-
-
+        return bool(self._header[8] & 0x2)
@@ -0,0 +1,191 @@
+"""Build BSA archives (v104 for Skyrim, v105 for Skyrim Special Edition) from a folder.
+
+Usage Example - Pack the assets of a mod:
+    from elder_scrolls.bsa_packer import pack_archive
+
+    pack_archive(os.path.join(mod_folder, 'Data'), os.path.join(release_folder, 'MyMod.bsa'), version=105)
+"""
+import collections
+import itertools
+import os
+import shutil
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from .bsa_file import BethesdaSoftwareArchive, COMPRESSION_TOGGLE_BIT, _HEADER, _FOLDER_RECORDS, _FILE_RECORD
+
+
+# Archive flags
+HAS_FOLDER_NAMES = 0x1
+HAS_FILE_NAMES = 0x2
+IS_COMPRESSED_BY_DEFAULT = 0x4
+
+# File flags, by the top-level folder of the files.
+FILE_FLAGS = {
+    'meshes': 0x1,
+    'textures': 0x2,
+    'interface': 0x4,
+    'sound': 0x8,
+    'shadersfx': 0x20,
+    'trees': 0x40,
+    'fonts': 0x80,
+}
+MISCELLANEOUS_FILE_FLAG = 0x100
+VOICE_FILE_FLAG = 0x10
+
+MAX_OFFSET = 0xffffffff
+
+
+def pack_archive(folder_path: str, file_path: str, version: int=105, compress: bool=True,
+                 workers: Optional[int]=None) -> int:
+    """Write the files under `folder_path` into a new BSA archive, and return the number of files.
+
+    The paths in the archive are relative to `folder_path`, for example 'textures\\sky\\stars.dds'.
+    Folders and the files in each folder are sorted by their hashes, as the game requires. Files are
+    compressed with zlib for v104 and LZ4 for v105, in `workers` processes, and written to the archive
+    as they are compressed. Files that do not get smaller are stored uncompressed.
+    """
+    if version not in _FOLDER_RECORDS:
+        raise ValueError(f'Unknown BSA file version: {version}')
+    if compress and version >= 105 and lz4 is None:
+        raise ImportError('Compressing v105 archives requires the lz4 package: pip install lz4')
+    folders = _list_files(folder_path)
+    folder_names = sorted(folders, key=BethesdaSoftwareArchive._calculate_hash)
+    files = [(folder_name, file_name, folders[folder_name][file_name])
+             for folder_name in folder_names
+             for file_name in sorted(folders[folder_name],
+                                     key=lambda file_name: BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True))]
+
+    folder_record = _FOLDER_RECORDS[version]
+    total_folder_name_length = sum(len(folder_name.encode()) + 1 for folder_name in folder_names)
+    total_file_name_length = sum(len(file_name.encode()) + 1 for _, file_name, _ in files)
+    file_records_start = _HEADER.size + len(folder_names) * folder_record.size
+    directory_size = (file_records_start
+                      + total_folder_name_length + len(folder_names)
+                      + len(files) * _FILE_RECORD.size
+                      + total_file_name_length)
+
+    archive_flags = HAS_FOLDER_NAMES | HAS_FILE_NAMES | (IS_COMPRESSED_BY_DEFAULT if compress else 0)
+    with open(file_path, 'wb') as archive:
+        archive.write(_HEADER.pack(b'BSA\x00', version, _HEADER.size, archive_flags, len(folder_names), len(files),
+                                   total_folder_name_length, total_file_name_length,
+                                   _get_file_flags(folder_names), 0))
+        # The directory is written after the data, when the sizes of the compressed files are known.
+        archive.seek(directory_size)
+        file_records = _write_data(archive, files, version, compress, workers)
+        archive.seek(_HEADER.size)
+        _write_directory(archive, folder_record, folder_names, folders, files, file_records,
+                         file_records_start, total_file_name_length)
+    return len(files)
+
+
+def _list_files(folder_path: str) -> Dict[str, Dict[str, str]]:
+    """Return the paths of the files under each subfolder, by the lower case folder and file names in the archive."""
+    folders = {}
+    for current_folder_path, _, file_names in os.walk(folder_path):
+        folder_name = os.path.relpath(current_folder_path, folder_path)
+        if folder_name == os.curdir:
+            continue
+        folder_name = folder_name.replace(os.sep, '\\').lower()
+        for file_name in file_names:
+            folders.setdefault(folder_name, {})[file_name.lower()] = os.path.join(current_folder_path, file_name)
+    return folders
+
+
+def _get_file_flags(folder_names: List[str]) -> int:
+    file_flags = 0
+    for folder_name in folder_names:
+        top_folder_name = folder_name.split('\\')[0]
+        if top_folder_name == 'sound' and folder_name.startswith('sound\\voice'):
+            file_flags |= VOICE_FILE_FLAG
+        else:
+            file_flags |= FILE_FLAGS.get(top_folder_name, MISCELLANEOUS_FILE_FLAG)
+    return file_flags
+
+
+def _write_data(archive, files, version: int, compress: bool, workers: Optional[int]) -> List[Tuple[int, int]]:
+    """Write the data of the files, and return their sizes, with the compression toggle bit, and offsets."""
+    file_records = []
+    if not compress:
+        for _, _, file_path in files:
+            offset = archive.tell()
+            with open(file_path, 'rb') as source_file:
+                shutil.copyfileobj(source_file, archive)
+            file_records.append(_get_file_record(archive.tell() - offset, offset))
+        return file_records
+
+    compression = 'lz4' if version >= 105 else 'zlib'
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Only a window of files is compressed ahead of the writer, so that the compressed files
+        # waiting to be written in order do not pile up in memory.
+        window_size = 2 * (workers or os.cpu_count() or 1)
+        pending = collections.deque()
+        file_paths = (file_path for _, _, file_path in files)
+        for file_path in itertools.islice(file_paths, window_size):
+            pending.append(executor.submit(_compress_file, file_path, compression))
+        while pending:
+            content, is_compressed = pending.popleft().result()
+            file_path = next(file_paths, None)
+            if file_path is not None:
+                pending.append(executor.submit(_compress_file, file_path, compression))
+            offset = archive.tell()
+            archive.write(content)
+            size = len(content) if is_compressed else len(content) | COMPRESSION_TOGGLE_BIT
+            file_records.append(_get_file_record(size, offset))
+    return file_records
+
+
+def _get_file_record(size: int, offset: int) -> Tuple[int, int]:
+    if offset > MAX_OFFSET:
+        raise ValueError('The files are too large for a BSA archive. Split them into more than one archive.')
+    return size, offset
+
+
+def _compress_file(file_path: str, compression: str) -> Tuple[bytes, bool]:
+    """Return the data of a file as it is stored in the archive, and whether it is compressed."""
+    with open(file_path, 'rb') as source_file:
+        content = source_file.read()
+    if compression == 'lz4':
+        compressed = lz4.frame.compress(content)
+    else:
+        compressed = zlib.compress(content)
+    # Compressed files start with their original size.
+    if len(compressed) + 4 >= len(content):
+        return content, False
+    return struct.pack('<I', len(content)) + compressed, True
+
+
+def _write_directory(archive, folder_record: struct.Struct, folder_names, folders, files, file_records,
+                     file_records_start: int, total_file_name_length: int):
+    folder_records, file_record_blocks = [], []
+    _pos = file_records_start
+    file_idx = 0
+    for folder_name in folder_names:
+        file_count = len(folders[folder_name])
+        folder_hash = BethesdaSoftwareArchive._calculate_hash(folder_name)
+        # The offset of a folder record points to its file records, plus the length of the file names.
+        offset = _pos + total_file_name_length
+        if folder_record.size == 16:
+            folder_records.append(folder_record.pack(folder_hash, file_count, offset))
+        else:
+            folder_records.append(folder_record.pack(folder_hash, file_count, 0, offset))
+        encoded_folder_name = folder_name.encode()
+        block = [bytes([len(encoded_folder_name) + 1]), encoded_folder_name, b'\x00']
+        for _, file_name, _ in files[file_idx:file_idx + file_count]:
+            size, file_offset = file_records[file_idx]
+            block.append(_FILE_RECORD.pack(BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True),
+                                           size, file_offset))
+            file_idx += 1
+        block = b''.join(block)
+        file_record_blocks.append(block)
+        _pos += len(block)
+    archive.write(b''.join(folder_records))
+    archive.write(b''.join(file_record_blocks))
+    archive.write(b''.join(file_name.encode() + b'\x00' for _, file_name, _ in files))
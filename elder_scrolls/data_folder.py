@@ -0,0 +1,112 @@
+import io
+import os
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from .bsa_file import BethesdaSoftwareArchive, hash_paths
+
+
+ARCHIVE_EXTENSION = '.bsa'
+
+
+class DataFolder:
+    """Find and open asset files in the Data folder, whether they are loose or inside archives.
+
+    The archives are opened once, in order, and their directories merged into one table that maps
+    the hashes of each path to the file that wins it: later archives override earlier ones, and
+    loose files override all archives, as in the game. Pass the archives in the order that the
+    game loads them, which follows the load order of their plugins. By default, all the BSA files
+    in the folder are used, sorted by name.
+
+    Usage example:
+
+    from elder_scrolls import DataFolder
+
+    data_folder_path = os.path.join(game_folder, 'Data')
+    with DataFolder(data_folder_path, ['Skyrim - Meshes0.bsa', 'Skyrim - Textures0.bsa']) as data_folder:
+        path = npc.get_face_tint_path_name('Skyrim.esm')
+        if data_folder.exists(path):
+            with data_folder.open(path) as face_tint:
+                header = face_tint.read(128)
+    """
+
+    def __init__(self, folder_path: str, archive_names: Optional[Iterable[str]]=None):
+        self.folder_path = folder_path
+        if archive_names is None:
+            archive_names = sorted(file_name for file_name in os.listdir(folder_path)
+                                   if file_name.lower().endswith(ARCHIVE_EXTENSION))
+        self.archives = []
+        # (folder hash, file hash) -> (archive, index of the file record) or (None, path of the loose file)
+        self._winners: Dict[Tuple[int, int], Tuple[Optional[BethesdaSoftwareArchive], Union[int, str]]] = {}
+        try:
+            for archive_name in archive_names:
+                archive = BethesdaSoftwareArchive(os.path.join(folder_path, archive_name)).__enter__()
+                self.archives.append(archive)
+                record_indices = archive._get_file_record_indices()
+                self._winners.update(zip(record_indices, ((archive, idx) for idx in record_indices.values())))
+            self._load_loose_files()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def __contains__(self, path: str):
+        return self.exists(path)
+
+    def __len__(self):
+        return len(self._winners)
+
+    def close(self):
+        for archive in self.archives:
+            archive.__exit__(None, None, None)
+
+    def exists(self, path: str) -> bool:
+        """Return True if there is a loose file or a file in an archive at the path under Data."""
+        return self._get_winner(path) is not None
+
+    def open(self, path: str) -> io.BufferedReader:
+        """Return a read-only file object for the winning file at the path under Data."""
+        winner = self._get_winner(path)
+        if winner is None:
+            raise FileNotFoundError(f'The file `{path}` not found in the loose files or the archives in {self.folder_path}.')
+        archive, location = winner
+        if archive is None:
+            return open(location, 'rb')
+        return io.BufferedReader(archive._get_file_reader_by_record(archive._read_file_record(location)))
+
+    def get_archive(self, path: str) -> Optional[BethesdaSoftwareArchive]:
+        """Return the archive that wins the path, or None if the winner is a loose file."""
+        winner = self._get_winner(path)
+        if winner is None:
+            raise FileNotFoundError(f'The file `{path}` not found in the loose files or the archives in {self.folder_path}.')
+        return winner[0]
+
+    def _get_winner(self, path: str):
+        folder_name, _, file_name = BethesdaSoftwareArchive.path.parse(path).strip('\\').rpartition('\\')
+        if not folder_name or not file_name:
+            return None
+        winner = self._winners.get((BethesdaSoftwareArchive._calculate_hash(folder_name),
+                                    BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True)))
+        if winner is not None:
+            archive, location = winner
+            if archive is not None and archive.has_file_names and archive._get_file_name(location) != file_name:
+                return None
+        return winner
+
+    def _load_loose_files(self):
+        """Add the files in the subfolders of the Data folder, which override the archives."""
+        relative_paths, file_paths = [], []
+        for folder_path, _, file_names in os.walk(self.folder_path):
+            relative_folder_path = os.path.relpath(folder_path, self.folder_path)
+            if relative_folder_path == os.curdir:
+                continue
+            for file_name in file_names:
+                relative_paths.append(os.path.join(relative_folder_path, file_name).replace(os.sep, '\\'))
+                file_paths.append(os.path.join(folder_path, file_name))
+        folder_hashes, file_hashes = hash_paths(relative_paths)
+        self._winners.update(zip(zip(map(int, folder_hashes), map(int, file_hashes)),
+                                 ((None, file_path) for file_path in file_paths)))
@@ -1,8 +1,34 @@
-from typing import Iterator
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .lib import Loader, _get_int
-from .record import Record, TES4
-from .group import Group
+from .record import Record, TES4, _get_record, _get_record_data, _inflated_contents, _iter_field_positions, _RECORD_HEADER
+from .group import Group, _iter_record_positions, _HEADER_PREFIX
+from .field import Field, FieldDecoder, decode_fields, get_field_decoder
+from .form_id import FormId
+from .string_table import STRING_TABLE_EXTENSIONS, StringTable
+
+
+INDEX_FILE_EXTENSION = '.idx'
+INDEX_FILE_VERSION = 1
+_INDEX_FILE_HEADER = struct.Struct('<4sHqQI')
+
+# type, data size, flags, form ID, timestamp, version control info: the first 20 bytes of a record header
+_HEADER_TABLE_FIELDS = struct.Struct('<IIIIHH')
+HEADER_TABLE_COLUMNS = ('offset', 'type', 'size', 'flags', 'form_id', 'timestamp', 'vc_info', 'parent')
+_HEADER_TABLE_TYPECODES = ('I', 'I', 'I', 'I', 'H', 'H')
+HEADER_TABLE_CHUNK_SIZE = 65536
 
 
 class ElderScrollsFile(Loader):
@@ -21,22 +47,42 @@ class ElderScrollsFile(Loader):
             print(npc.form_id)  # Print form IDs of all NPCs.
 
         print(skyrim_main_file[0x1033ee])  # Return the record with the form ID 0x1033ee
+
+        skyrim_main_file.parse_parallel(workers=8)  # Index every record, including nested ones.
+        print(len(skyrim_main_file['REFR']))  # print the number of placed references.
+
+        npc = skyrim_main_file[0x13bab]
+        npc['EDID'] = b'ChangedEditorId\x00'  # Change a field.
+        skyrim_main_file.save('Changed.esm')  # Write a copy of the file with the changed records.
+
+    The form ID index is built the first time a record is looked up by its form ID,
+    and saved next to the file (for example Skyrim.esm.idx), so that the next time
+    the file is opened, the index is read from there instead. Set `use_index_file`
+    to False to always build the index in memory.
     """
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, use_index_file: bool=True):
         super().__init__(file_path)
         try:
             assert self._read_bytes(0, 4) == b'TES4'
         except AssertionError:
             raise RuntimeError('Incorrect file header - is this a TES4 file?')
+        # Shared by every record of the file, so that changes and string tables loaded later reach all of them.
+        self._changed_records = {}
+        self._string_tables = {}
         self.header_record = TES4(self._mmap, 0)
+        self.header_record._changed_records = self._changed_records
+        self.header_record._strings = self._string_tables
         self.is_esm = self.header_record.is_esm
         self.is_esl = self.header_record.is_esl
+        self.is_localized = self.header_record.is_localized
         self.masters = self.header_record.masters
         self.author = self.header_record.author
         self.record_count = _get_int(self.header_record['HEDR'][4:8])
-        self._record_positions = {}
-        self._pos = {}
+        self.use_index_file = use_index_file
+        self._form_ids = None
+        self._form_id_positions = None
+        self._load_group_index()
 
     def __getitem__(self, key):
         if isinstance(key, slice):
@@ -44,57 +90,451 @@ class ElderScrollsFile(Loader):
                 raise KeyError(f'{self.__class__.__name__} does not allow slicing '
                                 'with a step. Use only one colon in slice, for example: [0:4]')
             return self._read_bytes(key.start, key.stop - key.start)
-        elif isinstance(key, int):
-            raise NotImplementedError
+        elif isinstance(key, (int, FormId)):
+            return self._get_record_at_position(self._get_record_position(int(key)))
         elif isinstance(key, Record):
             raise NotImplementedError
         elif isinstance(key, str):
             if len(key) == 4:
-                return [record for record in self.records.values() if record.type == key]
+                return list(self._get_records_by_type(key))
             elif key[:2] == '0x':
-                raise NotImplementedError
+                return self[int(key, 16)]
         else:
             raise KeyError
 
+    def __exit__(self, exception_type, exception_val, trace):
+        for key in _inflated_contents:
+            if key[0] is self._mmap:
+                del _inflated_contents[key]
+        for string_table in (self.strings or {}).values():
+            string_table.__exit__(None, None, None)
+        super().__exit__(exception_type, exception_val, trace)
+
+    def load_strings(self, language: str='english', archive=None):
+        """Load the string tables of a localized plugin, so that full names are returned as text.
+
+        The tables are read from the Strings folder next to the plugin, for example
+        Data/Strings/Skyrim_english.STRINGS, .DLSTRINGS and .ILSTRINGS, or from the archive if
+        one is given, for example the BethesdaSoftwareArchive of Skyrim - Interface.bsa.
+        """
+        if not self.is_localized:
+            raise RuntimeError(f'{self.file_name} is not localized: its strings are in the records.')
+        plugin_name = os.path.splitext(self.file_name)[0]
+        strings = {}
+        for extension in STRING_TABLE_EXTENSIONS:
+            file_name = f'{plugin_name}_{language}.{extension}'
+            if archive is None:
+                strings[extension] = StringTable(_find_file(os.path.join(os.path.dirname(self.file_path), 'Strings'),
+                                                            file_name))
+            else:
+                strings[extension] = StringTable.from_archive(archive, f'strings\\{file_name}')
+        self._string_tables.update(strings)
+
+    @property
+    def strings(self) -> Optional[Dict[str, StringTable]]:
+        """The string tables loaded with `load_strings`, by extension, or None if they are not loaded."""
+        return self._string_tables or None
+
+    @property
+    def record_types(self) -> Set[str]:
+        """Return the types of the records in the file.
+
+        Before the file is parsed with `parse_parallel`, these are the types of the top-level groups.
+        """
+        return set(self._type_groups)
+
+    def get_field_values(self, record_type: str, field_name: str) -> List:
+        """Return the decoded values of a field in every record of a type, in the order of the records.
+
+        The value is None for records without the field. For example, the ACBS stats of every NPC:
+            levels = [acbs[3] for acbs in skyrim_main_file.get_field_values('NPC_', 'ACBS') if acbs]
+        """
+        return decode_fields((_find_field(record, field_name) for record in self._get_records_by_type(record_type)),
+                             field_name, record_type)
+
+    def query(self, record_type: str, where: Optional[Dict[str, Callable]]=None,
+              select: Iterable[str]=('EDID',)) -> Iterator[Tuple]:
+        """Yield a tuple of the selected field values of every record of a type that matches `where`.
+
+        `where` maps field names to functions that take the decoded value of the field and return
+        whether the record matches. Records without one of these fields do not match. `select` is
+        the list of the fields to return, decoded as in FIELD_TYPES, or None if the record does not
+        have them. 'form_id' can be selected too. For example, the essential NPCs:
+            essential_npcs = list(skyrim_main_file.query('NPC_', where={'ACBS': lambda acbs: acbs[0] & 0x2},
+                                                         select=['form_id', 'EDID', 'ACBS']))
+
+        No Record or Field objects are built: only the headers of the fields are read, until the
+        selected fields and the `where` fields have been found, and a record is skipped as soon as
+        one of its fields does not match. Only the first field with each name is used.
+        """
+        where = dict(where or {})
+        select = list(select)
+        field_names = list(where) + [name for name in select if name != 'form_id' and name not in where]
+        decoders = {name.encode('ascii'): (name, get_field_decoder(name, record_type)) for name in field_names}
+        conditions = {name.encode('ascii'): predicate for name, predicate in where.items()}
+        for _pos in self._iter_positions_by_type(record_type):
+            try:
+                changed_record = self._changed_records[_pos]
+            except KeyError:
+                _, size, flags, form_id, _, _, _, _ = _RECORD_HEADER.unpack_from(self._mmap, _pos)
+                data, start, end = _get_record_data(self._mmap, _pos, size, flags)
+            else:
+                form_id = changed_record._form_id
+                data, start, end = changed_record._get_data()
+            values = _match_fields(data, start, end, decoders, conditions)
+            if values is not None:
+                values['form_id'] = form_id
+                yield tuple(values.get(name) for name in select)
+
+    def header_table(self) -> Union['np.ndarray', Dict[str, array]]:
+        """Return the headers of all records as columns.
+
+        The columns are the position of the record, its type as a little-endian four
+        character code, data size, flags, form ID, timestamp, version control info and the position
+        of its parent group (-1 for the TES4 record). If NumPy is installed, a structured
+        array is returned, otherwise a dictionary of `array` columns.
+
+        With NumPy, queries become masks, for example:
+            table = skyrim_main_file.header_table()
+            npc_type = int.from_bytes(b'NPC_', 'little')
+            deleted = table[table['flags'] & 0x20 != 0]
+            compressed_npcs = table[(table['type'] == npc_type) & (table['flags'] & 0x40000 != 0)]
+            from_dawnguard = table[table['form_id'] >> 24 == 0x02]
+
+        The positions of the records are found with a walk over the headers, after which
+        the other columns are decoded from the file in bulk.
+        """
+        offsets, parents = array('q'), array('q')
+        for _pos, parent in _iter_record_positions(self._mmap, 0, len(self._mmap)):
+            offsets.append(_pos)
+            parents.append(-1 if parent is None else parent)
+
+        if np is None:
+            columns = {name: array(typecode) for name, typecode in zip(HEADER_TABLE_COLUMNS[1:-1], _HEADER_TABLE_TYPECODES)}
+            appends = [column.append for column in columns.values()]
+            for _pos in offsets:
+                for append, value in zip(appends, _HEADER_TABLE_FIELDS.unpack_from(self._mmap, _pos)):
+                    append(value)
+            return {'offset': offsets, **columns, 'parent': parents}
+
+        header_dtype = np.dtype([('type', '<u4'), ('size', '<u4'), ('flags', '<u4'), ('form_id', '<u4'),
+                                 ('timestamp', '<u2'), ('vc_info', '<u2')])
+        table = np.empty(len(offsets), dtype=[('offset', '<i8'), *header_dtype.descr, ('parent', '<i8')])
+        table['offset'] = np.frombuffer(offsets, dtype=np.int64)
+        table['parent'] = np.frombuffer(parents, dtype=np.int64)
+        data = np.frombuffer(self._mmap, dtype=np.uint8)
+        byte_positions = np.arange(_HEADER_TABLE_FIELDS.size)
+        for start in range(0, len(table), HEADER_TABLE_CHUNK_SIZE):
+            chunk = table[start:start + HEADER_TABLE_CHUNK_SIZE]
+            headers = data[chunk['offset'][:, None] + byte_positions].view(header_dtype)[:, 0]
+            for name in HEADER_TABLE_COLUMNS[1:-1]:
+                chunk[name] = headers[name]
+        return table
+
+    def save(self, file_path: str):
+        """Write the file, with the changed records, to a new file.
+
+        Unchanged parts of the file are copied from the memory map as they are, so only the
+        changed records and the headers of the groups around them are written anew. The sizes of
+        those groups and the record count in HEDR are recalculated, and changed records that are
+        compressed in the original file are compressed again.
+        """
+        if os.path.exists(file_path) and os.path.samefile(file_path, self.file_path):
+            raise ValueError(f'Cannot save over {self.file_name} while it is open. Save to another path.')
+
+        record_count = self._count_records()
+        if _get_int(self.header_record['HEDR'][4:8]) != record_count:
+            hedr = bytearray(self.header_record['HEDR'].bytes)
+            struct.pack_into('<I', hedr, 4, record_count)
+            self.header_record['HEDR'] = hedr
+            self.record_count = record_count
+
+        changed_positions = sorted(self._changed_records)
+        changed_records = [self._changed_records[_pos]._to_bytes() for _pos in changed_positions]
+        size_changes = [0]
+        for _pos, record in zip(changed_positions, changed_records):
+            size_changes.append(size_changes[-1] + len(record) - Record.header_size - self._changed_records[_pos].size)
+
+        data = memoryview(self._mmap)
+        with open(file_path, 'wb') as output_file:
+            copied_until = 0
+            _pos = 0
+            for idx, changed_position in enumerate(changed_positions):
+                while _pos < changed_position:
+                    record_type, size = _HEADER_PREFIX.unpack_from(self._mmap, _pos)
+                    if record_type != b'GRUP':
+                        _pos += Record.header_size + size
+                    elif _pos + size <= changed_position:
+                        _pos += size
+                    else:
+                        # The group contains the changed record: write its header with the new size.
+                        size_change = size_changes[bisect_left(changed_positions, _pos + size)] - size_changes[idx]
+                        output_file.write(data[copied_until:_pos])
+                        output_file.write(_HEADER_PREFIX.pack(record_type, size + size_change))
+                        output_file.write(data[_pos + _HEADER_PREFIX.size:_pos + Group.header_size])
+                        _pos += Group.header_size
+                        copied_until = _pos
+                output_file.write(data[copied_until:changed_position])
+                output_file.write(changed_records[idx])
+                _pos = changed_position + Record.header_size + self._changed_records[changed_position].size
+                copied_until = _pos
+            output_file.write(data[copied_until:])
+
+    def _count_records(self) -> int:
+        """Return the number of records and groups in the file, not counting the header record."""
+        count = 0
+        _pos = self.header_record.size + Record.header_size
+        while _pos < len(self._mmap):
+            record_type, size = _HEADER_PREFIX.unpack_from(self._mmap, _pos)
+            _pos += Group.header_size if record_type == b'GRUP' else Record.header_size + size
+            count += 1
+        return count
+
+    def _load_group_index(self):
+        """Map the label of every top-level group to its position and size.
+
+        Only the group headers are read, the contents of the groups are skipped.
+        Until the file is parsed, each record type is only known to be in its own group.
+        """
+        self._groups = {}
+        _pos = self.header_record.size + Record.header_size
+        while _pos < len(self._mmap):
+            group = Group(self._mmap, _pos)
+            self._groups[group.label] = (_pos, group.size)
+            _pos += group.size
+        self._type_groups = {label: [label] for label in self._groups}
+
+    def parse_parallel(self, workers: Optional[int]=None):
+        """Index every record in the file, reading the top-level groups in parallel processes.
+
+        Each worker maps the file itself and returns only the form IDs, positions and types
+        of the records in its groups, which are merged into the form ID index and the type
+        index. Afterwards, record types that are only found in nested groups (for example REFR,
+        ACHR and INFO) can be looked up by type as well. `workers` defaults to the number of CPUs.
+        """
+        groups = sorted(self._groups.items(), key=lambda item: item[1][1], reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(label, executor.submit(_index_file_range, self.file_path, _pos, _pos + size))
+                       for label, (_pos, size) in groups]
+            results = [(label, future.result()) for label, future in futures]
+
+        type_groups = {}
+        for label, (_, _, record_types) in results:
+            for record_type in record_types:
+                type_groups.setdefault(record_type, []).append(label)
+        # Each worker has sorted its own index already.
+        self._form_ids, self._form_id_positions = _merge_indices([(form_ids, positions)
+                                                                  for _, (form_ids, positions, _) in results])
+        self._type_groups = {record_type: sorted(labels, key=lambda label: self._groups[label][0])
+                             for record_type, labels in type_groups.items()}
+        if self.use_index_file:
+            self._write_index_file(self._form_ids, self._form_id_positions)
+
+    @property
+    def index_file_path(self) -> str:
+        return self.file_path + INDEX_FILE_EXTENSION
+
+    def _get_record_position(self, form_id: int) -> int:
+        if self._form_ids is None:
+            self._load_form_id_index()
+        idx = bisect_left(self._form_ids, form_id)
+        if idx < len(self._form_ids) and self._form_ids[idx] == form_id:
+            return self._form_id_positions[idx]
+        raise KeyError(f'Form ID {hex(form_id)} not found in {self.file_name}.')
+
+    def _load_form_id_index(self):
+        index = self._read_index_file() if self.use_index_file else None
+        if index is None:
+            index = self._build_form_id_index()
+            if self.use_index_file:
+                self._write_index_file(*index)
+        self._form_ids, self._form_id_positions = index
+
+    def _build_form_id_index(self) -> Tuple[array, array]:
+        """Return the form IDs of all records, sorted, and the positions of the records.
+
+        Only the record headers are read, including the records in nested groups.
+        """
+        start = self.header_record.size + Record.header_size
+        form_ids, positions, _ = _index_records(self._mmap, start, len(self._mmap))
+        return _sort_index(form_ids, positions)
+
+    def _get_index_file_key(self) -> Tuple[int, int]:
+        stat = os.stat(self.file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_index_file(self) -> Optional[Tuple[array, array]]:
+        """Return the form ID index saved next to the file, or None if it is missing or stale."""
+        try:
+            with open(self.index_file_path, 'rb') as index_file:
+                content = index_file.read()
+        except OSError:
+            return None
+        try:
+            magic, version, mtime, size, count = _INDEX_FILE_HEADER.unpack_from(content)
+        except struct.error:
+            return None
+        if (magic, version) != (b'ESID', INDEX_FILE_VERSION) or (mtime, size) != self._get_index_file_key():
+            return None
+        form_ids, positions = array('I'), array('I')
+        column_size = count * form_ids.itemsize
+        _pos = _INDEX_FILE_HEADER.size
+        if len(content) != _pos + 2 * column_size:
+            return None
+        form_ids.frombytes(content[_pos:_pos + column_size])
+        positions.frombytes(content[_pos + column_size:])
+        return form_ids, positions
+
+    def _write_index_file(self, form_ids: array, positions: array):
+        """Save the form ID index next to the file. Failing to write it is not an error."""
+        temporary_path = self.index_file_path + '.tmp'
+        try:
+            with open(temporary_path, 'wb') as index_file:
+                index_file.write(_INDEX_FILE_HEADER.pack(b'ESID', INDEX_FILE_VERSION,
+                                                         *self._get_index_file_key(), len(form_ids)))
+                index_file.write(form_ids.tobytes())
+                index_file.write(positions.tobytes())
+            os.replace(temporary_path, self.index_file_path)
+        except OSError:
+            pass
+
     def _get_type_at_position(self, pos: int) -> str:
         return self._mmap[pos:pos + 4].decode('ascii')
 
     def _get_record_at_position(self, pos: int) -> Record:
-        return Record(self._mmap, pos)
+        """Return the record at the position, or the changed record if it has been changed."""
+        if pos == 0:
+            return self.header_record
+        return _get_record(self._mmap, pos, self._changed_records, self._string_tables)
 
+    def get_group(self, label: str) -> Group:
+        """Return a top-level group by its label, for example 'NPC_'.
 
-    def _get_records_by_type(self, record_type: str, starting_position: int=0) -> Record:
-        _pos = starting_position
-        while _pos < len(self._mmap):
-            if self._get_type_at_position(_pos) == 'GRUP':
-                group = Group(self._mmap, _pos)
-                print("=== GRUP ===", group.type, group.label)
-                if group.is_top_level and group.label == record_type:
-                    for record in group._get_all_records():
-                        print(record.type)
-                        yield record
-                        _pos += record.size + record.header_size
-                else:
-                    _pos += group.size
+        Records read through the group are the same as the ones read from the file: changes to them
+        are saved with `save`, and their full names are looked up in the loaded string tables.
+        """
+        try:
+            _pos, _ = self._groups[label]
+        except KeyError:
+            raise KeyError(f'There is no top-level group {label} in {self.file_name}.')
+        group = Group(self._mmap, _pos)
+        group._changed_records = self._changed_records
+        group._strings = self._string_tables
+        return group
 
-            else:
-                record = Record(self._mmap, _pos)
-                print(record.type)
-                if record.type == record_type:
-                    yield record
-                _pos += record.size + record.header_size
+    def _get_records_by_type(self, record_type: str) -> Iterator[Record]:
+        for _pos in self._iter_positions_by_type(record_type):
+            yield self._get_record_at_position(_pos)
 
+    def _iter_positions_by_type(self, record_type: str) -> Iterator[int]:
+        encoded_record_type = record_type.encode('ascii')
+        for label in self._type_groups.get(record_type, []):
+            group_start, group_size = self._groups[label]
+            for _pos, _ in _iter_record_positions(self._mmap, group_start + Group.header_size,
+                                                  group_start + group_size, group_start):
+                if self._mmap[_pos:_pos + 4] == encoded_record_type:
+                    yield _pos
 
-    def _get_all_records(self, starting_position: int=0) -> Record:
-        _pos = starting_position
-        while _pos < len(self._mmap):
-            if self._get_type_at_position(_pos) == 'GRUP':
-                group = Group(self._mmap, _pos)
-                if group.is_top_level:
-                    for record in group._get_all_records():
-                        yield record
-                _pos += group.size
-            else:
-                record = Record(self._mmap, _pos)
-                yield record
-                _pos += record.size + record.header_size
+    def _get_all_records(self, starting_position: int=0) -> Iterator[Record]:
+        """Yield all records in the file, including the ones in nested groups."""
+        for _pos, _ in _iter_record_positions(self._mmap, starting_position, len(self._mmap)):
+            yield self._get_record_at_position(_pos)
+
+
+def _find_file(folder_path: str, file_name: str) -> str:
+    """Return the path of a file in a folder, whatever the case of its name, as it would be on Windows."""
+    if os.path.isdir(folder_path):
+        for name in os.listdir(folder_path):
+            if name.lower() == file_name.lower():
+                return os.path.join(folder_path, name)
+    raise FileNotFoundError(f'{file_name} not found in {folder_path}.')
+
+
+def _find_field(record: Record, field_name: str) -> Optional[Field]:
+    try:
+        return record.get_field(field_name)
+    except KeyError:
+        return None
+
+
+def _match_fields(data: memoryview, start: int, end: int, decoders: Dict[bytes, Tuple[str, Optional[FieldDecoder]]],
+                  conditions: Dict[bytes, Callable]) -> Optional[Dict[str, object]]:
+    """Return the decoded values of the fields of a record, by name, or None if the record does not match.
+
+    A field is decoded only when it is found, and its condition, if it has one, is checked right away.
+    """
+    values = {}
+    for field_name, _pos, field_size in _iter_field_positions(data, start, end):
+        if field_name not in decoders or decoders[field_name][0] in values:
+            continue
+        name, decoder = decoders[field_name]
+        content = data[_pos:_pos + field_size]
+        if decoder is None:
+            value = content.tobytes()
+        else:
+            try:
+                value = decoder(content)
+            except struct.error:
+                value = None
+        predicate = conditions.get(field_name)
+        if predicate is not None and (value is None or not predicate(value)):
+            return None
+        values[name] = value
+        if len(values) == len(decoders):
+            break
+    if len(values) < len(decoders) and any(decoders[field_name][0] not in values for field_name in conditions):
+        return None
+    return values
+
+
+def _index_records(_mmap: mmap.mmap, start: int, end: int) -> Tuple[array, array, Set[str]]:
+    """Return the form IDs, positions and the set of types of the records between start and end."""
+    form_ids = array('I')
+    positions = array('I')
+    record_types = set()
+    for _pos, _ in _iter_record_positions(_mmap, start, end):
+        record_type, _, _, form_id, _, _, _, _ = _RECORD_HEADER.unpack_from(_mmap, _pos)
+        record_types.add(record_type)
+        form_ids.append(form_id)
+        positions.append(_pos)
+    return form_ids, positions, {record_type.decode('ascii') for record_type in record_types}
+
+
+def _index_file_range(file_path: str, start: int, end: int) -> Tuple[array, array, Set[str]]:
+    """Run `_index_records` on a file in a worker process, which maps the file on its own."""
+    with open(file_path, 'rb') as _file:
+        with mmap.mmap(_file.fileno(), length=0, access=mmap.ACCESS_READ) as _mmap:
+            form_ids, positions, record_types = _index_records(_mmap, start, end)
+    return _sort_index(form_ids, positions) + (record_types,)
+
+
+def _sort_index(form_ids: array, positions: array) -> Tuple[array, array]:
+    """Sort the form ID and position columns by form ID."""
+    if np is not None:
+        order = np.argsort(np.frombuffer(form_ids, dtype=np.uint32), kind='stable')
+        return (_to_array(np.frombuffer(form_ids, dtype=np.uint32)[order]),
+                _to_array(np.frombuffer(positions, dtype=np.uint32)[order]))
+    order = sorted(range(len(form_ids)), key=form_ids.__getitem__)
+    return array('I', [form_ids[i] for i in order]), array('I', [positions[i] for i in order])
+
+
+def _merge_indices(indices: List[Tuple[array, array]]) -> Tuple[array, array]:
+    """Merge form ID and position columns that are each sorted by form ID into one index."""
+    if np is not None and indices:
+        form_ids = np.concatenate([np.frombuffer(form_ids, dtype=np.uint32) for form_ids, _ in indices])
+        positions = np.concatenate([np.frombuffer(positions, dtype=np.uint32) for _, positions in indices])
+        # Timsort finds the sorted runs, so this is a merge rather than a full sort.
+        order = np.argsort(form_ids, kind='stable')
+        return _to_array(form_ids[order]), _to_array(positions[order])
+    merged = heapq.merge(*(zip(form_ids, positions) for form_ids, positions in indices))
+    form_ids, positions = array('I'), array('I')
+    for form_id, position in merged:
+        form_ids.append(form_id)
+        positions.append(position)
+    return form_ids, positions
+
+
+def _to_array(column: 'np.ndarray') -> array:
+    converted = array('I')
+    converted.frombytes(column.astype(np.uint32).tobytes())
+    return converted
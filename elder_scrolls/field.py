@@ -1,16 +1,28 @@
 import struct
+from typing import Iterable, List, Optional, Tuple, Union
+
 from .lib import _get_str, _get_int
 
 
+# name, size
+_FIELD_HEADER = struct.Struct('<4sH')
+_FLOAT32 = struct.Struct('<f')
+
+
 class Field:
+    """A field (subrecord) of a record.
+
+    `bytes` is a slice of `content`: when `content` is a memoryview of the file, the field
+    refers to the file instead of copying it.
+    """
+    __slots__ = ('name', 'size', 'bytes')
     header_size = 6
 
-    def __init__(self, content: bytes):
+    def __init__(self, content: Union[bytes, memoryview]):
         if len(content) < self.header_size:
             raise ValueError(f'Field content is too small: {len(content)}')
-        self._pos = 0
-        self.name = _get_str(content[0:4])
-        self.size = _get_int(content[4:6])
+        name, self.size = _FIELD_HEADER.unpack_from(content)
+        self.name = _get_str(name)
         self.bytes = content[self.header_size:self.header_size + self.size]
 
     def __getitem__(self, item):
@@ -22,7 +34,7 @@ class Field:
             raise TypeError(f'Item must be an integer or slice, not {type(item)}')
 
     def __repr__(self):
-        return f'{self.name}: {self.bytes}'
+        return f'{self.name}: {bytes(self.bytes)}'
 
     def __hex__(self):
         return hex(_get_int(self.bytes))
@@ -34,35 +46,125 @@ class Field:
         return _get_int(self.bytes)
 
     def __float__(self, offset=0):
-        return struct.unpack('f', self.bytes)[0 + offset]
+        return _FLOAT32.unpack_from(self.bytes, offset)[0]
 
     def __len__(self):
         return self.header_size + self.size
 
-    def __call__(self):
-        if self.name in FIELD_TYPES:
-            if isinstance(FIELD_TYPES[self.name], tuple):
-                _pos = 0
-                value = tuple()
-                for _type in FIELD_TYPES[self.name]:
-                    if _type == 'float32':
-                        value.append(self.__float__(_pos))
-                        _pos += 4
-                    elif _type == 'uint32':
-                        value.append(_get_int(self.bytes[_pos:_pos + 4]))
-                        _pos += 4
-                return value
-            elif FIELD_TYPES[self.name] == 'zstring':
-                return _get_str(self.bytes)
-            else:
-                raise NotImplementedError(f'Field type {self.name} is not implemented yet')
-        else:
+    def __call__(self, record_type: Optional[str]=None):
+        """Return the value of the field, decoded as in FIELD_TYPES, or the bytes if its type is unknown.
+
+        Fields with more than one value are decoded into a tuple. Pass the type of the record
+        for fields that are laid out differently in different records, such as DATA.
+        """
+        decoder = get_field_decoder(self.name, record_type)
+        if decoder is None:
             return self.bytes
+        return decoder(self.bytes)
 
+
+# The types of the fields, by field name, or by (record type, field name) for fields that depend
+# on the record. A type is 'zstring', one of the names in _STRUCT_FORMATS, or a tuple of them.
 FIELD_TYPES = {
     'HEDR': ('float32', 'uint32', 'uint32'),
     'CNAM': 'zstring',
     'SNAM': 'zstring',
     'MAST': 'zstring',
     'EDID': 'zstring',
-}
\ No newline at end of file
+    'OBND': ('int16', 'int16', 'int16', 'int16', 'int16', 'int16'),
+    # flags, magicka offset, stamina offset, level (or level multiplier x 1000), minimum level,
+    # maximum level, speed multiplier, disposition, template flags, health offset, bleedout override
+    ('NPC_', 'ACBS'): ('uint32', 'int16', 'int16', 'uint16', 'uint16', 'uint16', 'uint16', 'int16',
+                       'uint16', 'int16', 'uint16'),
+    ('NPC_', 'RNAM'): 'formid',
+    ('NPC_', 'CNAM'): 'formid',
+    # value, weight, damage
+    ('WEAP', 'DATA'): ('uint32', 'float32', 'uint16'),
+    # value, weight
+    ('ARMO', 'DATA'): ('int32', 'float32'),
+    ('ARMO', 'DNAM'): 'int32',
+    # flags, type, unknown, skill or spell, value, weight
+    ('BOOK', 'DATA'): ('uint8', 'uint8', 'uint16', 'uint32', 'uint32', 'float32'),
+    ('INGR', 'DATA'): ('uint32', 'float32'),
+    ('MISC', 'DATA'): ('uint32', 'float32'),
+    ('KEYM', 'DATA'): ('uint32', 'float32'),
+    ('SLGM', 'DATA'): ('uint32', 'float32'),
+    ('ALCH', 'DATA'): 'float32',
+}
+
+_STRUCT_FORMATS = {
+    'int8': 'b', 'uint8': 'B',
+    'int16': 'h', 'uint16': 'H',
+    'int32': 'i', 'uint32': 'I', 'formid': 'I',
+    'int64': 'q', 'uint64': 'Q',
+    'float32': 'f', 'float64': 'd',
+}
+
+
+class FieldDecoder:
+    """Decode a field in one call, with a `struct.Struct` compiled from its type in FIELD_TYPES."""
+    __slots__ = ('struct', 'is_single_value')
+
+    def __init__(self, field_type: Union[str, Tuple[str, ...]]):
+        self.is_single_value = isinstance(field_type, str)
+        if field_type == 'zstring':
+            self.struct = None
+            return
+        field_types = (field_type,) if self.is_single_value else field_type
+        try:
+            self.struct = struct.Struct('<' + ''.join(_STRUCT_FORMATS[_type] for _type in field_types))
+        except KeyError as error:
+            raise ValueError(f'Unknown field type: {error.args[0]}')
+
+    def __call__(self, content: Union[bytes, memoryview], offset: int=0):
+        if self.struct is None:
+            return _get_str(content[offset:])
+        values = self.struct.unpack_from(content, offset)
+        return values[0] if self.is_single_value else values
+
+
+_FIELD_DECODERS = {key: FieldDecoder(field_type) for key, field_type in FIELD_TYPES.items()}
+
+
+def register_field_type(field_name: str, field_type: Union[str, Tuple[str, ...]], record_type: Optional[str]=None):
+    """Add or change the type of a field, for all records, or only for one type of record."""
+    key = field_name if record_type is None else (record_type, field_name)
+    _FIELD_DECODERS[key] = FieldDecoder(field_type)
+    FIELD_TYPES[key] = field_type
+
+
+def get_field_decoder(field_name: str, record_type: Optional[str]=None) -> Optional[FieldDecoder]:
+    """Return the decoder of a field in a type of record, or None if the type of the field is unknown."""
+    if record_type is not None:
+        decoder = _FIELD_DECODERS.get((record_type, field_name))
+        if decoder is not None:
+            return decoder
+    return _FIELD_DECODERS.get(field_name)
+
+
+def decode_fields(fields: Iterable[Optional[Field]], field_name: str, record_type: Optional[str]=None) -> List:
+    """Decode the same field from many records at once, for example ACBS from every NPC_.
+
+    `fields` may contain None for records without the field, and the value is None for them,
+    and for fields that are too short for their type. The fields that have the expected size
+    are joined and decoded in a single `iter_unpack`.
+    """
+    decoder = get_field_decoder(field_name, record_type)
+    fields = list(fields)
+    if decoder is None:
+        return [None if field is None else field.bytes for field in fields]
+    if decoder.struct is None:
+        return [None if field is None else decoder(field.bytes) for field in fields]
+    size = decoder.struct.size
+    values = decoder.struct.iter_unpack(b''.join([field.bytes for field in fields
+                                                  if field is not None and field.size == size]))
+    decoded = []
+    for field in fields:
+        if field is None or field.size < size:
+            decoded.append(None)
+        elif field.size == size:
+            value = next(values)
+            decoded.append(value[0] if decoder.is_single_value else value)
+        else:
+            decoded.append(decoder(field.bytes))
+    return decoded
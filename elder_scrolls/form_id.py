@@ -1,6 +1,7 @@
 class FormId:
-    # TODO: Implement __index__
     # TODO: Implement __format__
+    __slots__ = ('_bytes',)
+
     def __init__(self, byte):
         if not isinstance(byte, (bytes, str)):
             raise ValueError("Use a string or byte object to instantiate a Form ID.")
@@ -1,47 +1,113 @@
-from typing import Iterable
+from typing import Iterable, Iterator, Optional, Tuple, Union
 import mmap
+import struct
 
-from .record import Record
-from .lib import _get_int
+from .record import Record, _get_record
+from .form_id import FormId
+
+
+GROUP_TYPES = {
+    0: 'Top',
+    1: 'World Children',
+    2: 'Interior Cell Block',
+    3: 'Interior Cell Sub-Block',
+    4: 'Exterior Cell Block',
+    5: 'Exterior Cell Sub-Block',
+    6: 'Cell Children',
+    7: 'Topic Children',
+    8: 'Cell Persistent Children',
+    9: 'Cell Temporary Children',
+    10: 'Cell Visible Distant Children',
+}
+
+# type, group size, label, group type, timestamp, version control info, unknown
+_GROUP_HEADER = struct.Struct('<4sI4sIHHI')
+
+# type, size: the start of a record or group header
+_HEADER_PREFIX = struct.Struct('<4sI')
 
 
 class Group(Record):
+    __slots__ = ('_label', '_group_type')
+
     def __init__(self, mmap: mmap.mmap, pointer: int):
-        super().__init__(mmap, pointer)
-        if self._header[0:4].decode('ascii') != 'GRUP':
+        self._pointer = pointer
+        self._mmap = mmap
+        record_type, self._size, self._label, self._group_type, _, _, _ = _GROUP_HEADER.unpack_from(mmap, pointer)
+        if record_type != b'GRUP':
             raise TypeError(f'Group record must have the type GRUP.')
+        self._type = 'GRUP'
+        self._changed_records = None
+        self._strings = None
 
     @property
-    def label(self):
+    def label(self) -> Union[str, int, Tuple[int, int], FormId]:
+        """Return the label of the group, which depends on the group type.
+
+        Top-level groups: the record type in the group, for example 'NPC_'.
+        Interior cell (sub-)blocks: the block number.
+        Exterior cell (sub-)blocks: the grid coordinates as (Y, X), in the order they are stored.
+        Other groups: the form ID of the parent record (WRLD, CELL or DIAL).
+        """
+        label = self._label
         if self.type == 0:
-            return self._header[8:12].decode('ascii')
-        elif self.type in [1, 6, 7, 8, 9]:
-            raise NotImplementedError('Group label is only available for top-level groups.')
-            # TODO: Return a FormID
+            return label.decode('ascii')
+        elif self.type in [2, 3]:
+            return struct.unpack('<i', label)[0]
+        elif self.type in [4, 5]:
+            return struct.unpack('<hh', label)
+        elif self.type in GROUP_TYPES:
+            return FormId(label)
         else:
-            raise NotImplementedError('Group label is only available for top-level groups.')
+            raise NotImplementedError(f'Unknown group type: {self.type}')
 
     @property
     def type(self):
-        return _get_int(self._header[12:16])
+        return self._group_type
+
+    @property
+    def type_name(self) -> str:
+        return GROUP_TYPES[self.type]
 
     @property
     def version(self):
-        return int.from_bytes(self._header[18:20], 'little', signed=False)
+        return _GROUP_HEADER.unpack_from(self._mmap, self._pointer)[5]
 
     @property
     def is_top_level(self):
         return self.type == 0
 
     def _get_all_records(self, starting_pointer: int=0) -> Iterable[Record]:
+        """Yield all records in the group, including the ones in nested groups.
+
+        Groups from `ElderScrollsFile.get_group` yield the changed records of the file instead of the
+        original ones, and the records they yield are registered with the file when they are changed.
+        """
         pointer = self._pointer + self.header_size + starting_pointer
-        while pointer < self._pointer + self.size:
-            if self._mmap[pointer:pointer + 4].decode('ascii') == 'GRUP':
-                group = Group(self._mmap, pointer)
-                if group.is_top_level:
-                    yield from group._get_all_records()
-                pointer += group.size
-            else:
-                record = Record(self._mmap, pointer)
-                yield record
-                pointer += record.size + Record.header_size
+        for record_pointer, _ in _iter_record_positions(self._mmap, pointer, self._pointer + self.size, self._pointer):
+            yield _get_record(self._mmap, record_pointer, self._changed_records, self._strings)
+
+
+def _iter_record_positions(mmap: mmap.mmap, start: int, end: int,
+                           parent: Optional[int]=None) -> Iterator[Tuple[int, Optional[int]]]:
+    """Yield the position of every record between start and end, and the position of its group.
+
+    Nested groups are entered in place instead of recursing into them: only a stack of the
+    positions and ends of the open groups is kept, which is as deep as the nesting of the
+    groups (at most five in Skyrim.esm). Records directly under start get `parent` as their group.
+    """
+    groups = []
+    _pos = start
+    while _pos < end:
+        while groups and _pos >= groups[-1][1]:
+            groups.pop()
+        record_type, size = _HEADER_PREFIX.unpack_from(mmap, _pos)
+        if record_type == b'GRUP':
+            group_end = _pos + size
+            if group_end < _pos + Group.header_size or group_end > (groups[-1][1] if groups else end):
+                raise RuntimeError(f'Group at position {_pos} has an invalid size.')
+            groups.append((_pos, group_end))
+            _pos += Group.header_size
+        else:
+            yield _pos, groups[-1][0] if groups else parent
+            _pos += Record.header_size + size
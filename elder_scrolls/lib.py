@@ -1,5 +1,7 @@
 import os
 import mmap
+from collections import OrderedDict
+from typing import Callable, Hashable
 
 STRING_ENCODINGS = ['utf-8', 'windows-1252']
 
@@ -18,7 +20,7 @@ def _get_int(content: bytes):
 def _get_str(content: bytes, encoding='utf-8'):
     for encoding in STRING_ENCODINGS:
         try:
-            return content.decode(encoding).strip('\0')
+            return str(content, encoding).strip('\0')
         except UnicodeDecodeError:
             pass
 
@@ -34,8 +36,8 @@ class Loader:
         self._mmap = mmap.mmap(self._file.fileno(), length=0, access=mmap.ACCESS_READ)
 
     def _read_bytes(self, pos: int, length: int=1) -> bytes:
-        self._mmap.seek(pos)
-        return self._mmap.read(length)
+        # Slicing does not move the position of the mmap, so it can be read from several threads at once.
+        return self._mmap[pos:pos + length]
 
     def _read_string(self, _pos, encoding='utf-8'):
         _bytes = self._read_bytes(_pos)
@@ -50,3 +52,49 @@ class Loader:
 
     def __exit__(self, exception_type, exception_val, trace):
         self._file.close()
+
+
+class LRUCache:
+    """A dictionary that drops the least recently used items to keep its total size under `max_size`.
+
+    The size of an item is `get_size(value)`, which is the length of the value by default.
+    Items that are larger than `max_size` on their own are not cached.
+    """
+    def __init__(self, max_size: int, get_size: Callable=len):
+        self.max_size = max_size
+        self.size = 0
+        self._get_size = get_size
+        self._items = OrderedDict()
+
+    def __getitem__(self, key: Hashable):
+        value = self._items[key]
+        self._items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value):
+        if key in self._items:
+            del self[key]
+        size = self._get_size(value)
+        if size > self.max_size:
+            return
+        self._items[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= self._get_size(evicted)
+
+    def __delitem__(self, key: Hashable):
+        self.size -= self._get_size(self._items.pop(key))
+
+    def __contains__(self, key: Hashable):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
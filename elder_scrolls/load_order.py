@@ -0,0 +1,142 @@
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from .elder_scrolls_file import ElderScrollsFile
+from .form_id import FormId
+from .record import Record
+
+
+MAX_FULL_PLUGIN_COUNT = 0xFE
+MAX_LIGHT_PLUGIN_COUNT = 0x1000
+LIGHT_PLUGIN_MOD_INDEX = 0xFE
+
+
+class LoadOrder:
+    """Open a list of plugins in load order and find the plugin that wins each form ID.
+
+    Form IDs in a plugin are local to it: their mod index points into the plugin's own list
+    of masters, and an index past the masters means the plugin itself. The load order maps
+    them to global form IDs, in the same way as the game does: full plugins get the next
+    mod index (00-FD), and light plugins (ESL flagged or .esl files) share the mod index FE,
+    with the next light index in the following three hex digits (FExxx).
+
+    Usage example:
+
+    from elder_scrolls import LoadOrder
+
+    plugins = ['Skyrim.esm', 'Update.esm', 'Dawnguard.esm', 'HearthFires.esm', 'Dragonborn.esm']
+    with LoadOrder([os.path.join(game_folder, 'Data', plugin) for plugin in plugins]) as load_order:
+        print(load_order.get_winner(0x0001A66B).file_name)  # The last plugin to change the record.
+        print(load_order[0x0001A66B].editor_id)  # The winning version of the record.
+    """
+
+    def __init__(self, file_paths: Iterable[str], use_index_file: bool=True):
+        self.files = []
+        self._prefixes = {}
+        full_count, light_count = 0, 0
+        try:
+            for file_path in file_paths:
+                elder_scrolls_file = ElderScrollsFile(file_path, use_index_file=use_index_file)
+                self.files.append(elder_scrolls_file)
+                if self._is_light(elder_scrolls_file):
+                    if light_count >= MAX_LIGHT_PLUGIN_COUNT:
+                        raise RuntimeError(f'Too many light plugins in the load order: {file_path}')
+                    prefix = (LIGHT_PLUGIN_MOD_INDEX << 24 | light_count << 12, 0xfff)
+                    light_count += 1
+                else:
+                    if full_count >= MAX_FULL_PLUGIN_COUNT:
+                        raise RuntimeError(f'Too many plugins in the load order: {file_path}')
+                    prefix = (full_count << 24, 0xffffff)
+                    full_count += 1
+                self._prefixes[elder_scrolls_file.file_name.lower()] = prefix
+            self._mod_index_maps = [self._get_mod_index_map(f) for f in self.files]
+        except Exception:
+            self.close()
+            raise
+        self._winners = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self) -> Iterator[ElderScrollsFile]:
+        return iter(self.files)
+
+    def __getitem__(self, key: Union[int, str, FormId]) -> Record:
+        """Return the winning version of the record with a global form ID."""
+        if isinstance(key, str):
+            key = int(key, 16)
+        form_id = int(key)
+        file_index = self._get_winner_index(form_id)
+        return self.files[file_index][self._get_local_form_id(file_index, form_id)]
+
+    def __contains__(self, key: Union[int, str, FormId]):
+        if isinstance(key, str):
+            key = int(key, 16)
+        if self._winners is None:
+            self._load_winners()
+        return int(key) in self._winners
+
+    def close(self):
+        for elder_scrolls_file in self.files:
+            elder_scrolls_file.__exit__(None, None, None)
+
+    def get_winner(self, form_id: Union[int, FormId]) -> ElderScrollsFile:
+        """Return the last plugin in the load order that contains the global form ID."""
+        return self.files[self._get_winner_index(int(form_id))]
+
+    def get_global_form_id(self, elder_scrolls_file: ElderScrollsFile, form_id: Union[int, FormId]) -> int:
+        """Return the global form ID of a form ID that is local to one of the plugins."""
+        prefix, mask = self._get_mod_index_entry(self._mod_index_maps[self.files.index(elder_scrolls_file)],
+                                                 int(form_id))
+        return prefix | int(form_id) & mask
+
+    @staticmethod
+    def _is_light(elder_scrolls_file: ElderScrollsFile) -> bool:
+        return elder_scrolls_file.is_esl or elder_scrolls_file.file_name.lower().endswith('.esl')
+
+    @staticmethod
+    def _get_mod_index_entry(mod_index_map: List[Tuple[int, int]], form_id: int) -> Tuple[int, int]:
+        return mod_index_map[min(form_id >> 24, len(mod_index_map) - 1)]
+
+    def _get_mod_index_map(self, elder_scrolls_file: ElderScrollsFile) -> List[Tuple[int, int]]:
+        """Return the (prefix, mask) of the global form IDs for each local mod index in a plugin."""
+        mod_index_map = []
+        for master in elder_scrolls_file.masters + [elder_scrolls_file.file_name]:
+            try:
+                mod_index_map.append(self._prefixes[master.lower()])
+            except KeyError:
+                raise RuntimeError(f'{elder_scrolls_file.file_name} requires {master}, '
+                                   'which is not earlier in the load order.')
+        return mod_index_map
+
+    def _get_local_form_id(self, file_index: int, form_id: int) -> int:
+        for mod_index, (prefix, mask) in enumerate(self._mod_index_maps[file_index]):
+            if form_id & ~mask == prefix:
+                return mod_index << 24 | form_id & mask
+        raise KeyError(f'Form ID {hex(form_id)} cannot be in {self.files[file_index].file_name}.')
+
+    def _get_winner_index(self, form_id: int) -> int:
+        if self._winners is None:
+            self._load_winners()
+        try:
+            return self._winners[form_id]
+        except KeyError:
+            raise KeyError(f'Form ID {hex(form_id)} not found in the load order.')
+
+    def _load_winners(self):
+        """Map the global form ID of every record to the index of the last plugin that contains it."""
+        winners = {}
+        for file_index, elder_scrolls_file in enumerate(self.files):
+            if elder_scrolls_file._form_ids is None:
+                elder_scrolls_file._load_form_id_index()
+            mod_index_map = self._mod_index_maps[file_index]
+            last_mod_index = len(mod_index_map) - 1
+            for form_id in elder_scrolls_file._form_ids:
+                prefix, mask = mod_index_map[min(form_id >> 24, last_mod_index)]
+                winners[prefix | form_id & mask] = file_index
+        self._winners = winners
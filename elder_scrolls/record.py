@@ -1,41 +1,69 @@
 import mmap
+import struct
+import sys
 import zlib
-from typing import Union, Iterator
+from array import array
+from typing import Iterable, Optional, Union, Iterator, Tuple
+
+from .field import Field, _FIELD_HEADER
+from .form_id import FormId
+from .lib import LRUCache, _get_str
+
+
+INFLATED_CONTENT_CACHE_SIZE = 64 * 1024 * 1024
+
+# The inflated contents of compressed records, keyed by (mmap, position), shared by all records.
+_inflated_contents = LRUCache(INFLATED_CONTENT_CACHE_SIZE)
+
+# type, data size, flags, form ID, timestamp, version control info, internal version, unknown
+_RECORD_HEADER = struct.Struct('<4sIIIHHHH')
+_UINT = struct.Struct('<I')
+COMPRESSED_FLAG = 1 << 18
 
-from .field import Field
-from .lib import _get_bit, _get_int, _get_str
 
 class Record:
-    """A record is a block of data in a file. It has a header and a content."""
+    """A record is a block of data in a file. It has a header and a content.
+
+    The type, size, flags and form ID are decoded once, when the record is created. The rest of
+    the header and the content are read from the file when needed, without copying them.
+
+    The first time a field is looked up, the headers of all the fields are read in a single pass,
+    into an array of the name (as a little-endian four character code), the position of the content
+    and the size of each field, and a dictionary of where the fields of each name are in the array.
+    Every later lookup is served from these.
+    """
+    __slots__ = ('_pointer', '_mmap', '_type', '_size', '_flags', '_form_id',
+                 '_fields', '_field_lookup', '_values', '_edited_content', '_changed_records', '_strings')
     header_size = 24
 
     def __init__(self, mmap: mmap.mmap, pointer: int):
         self._pointer = pointer
         self._mmap = mmap  # TODO: Use this to read the content of the record
-        self._header = mmap[pointer:pointer + self.header_size]
-        if self._header[0:4].decode('ascii') != 'GRUP':
-            if self.__class__.__name__ == 'Group':
-                raise TypeError(f'{self.__class__.__name__} cannot be initialized as Group.')
-            self._field_positions = {}
-            self._pos = {}
-            self._is_parsing_complete = False
-        else:
-            if self.__class__.__name__ != 'Group':
-                raise TypeError(f'Group record must be of type Group, not {self.__class__.__name__}.')
+        record_type, self._size, self._flags, self._form_id, _, _, _, _ = _RECORD_HEADER.unpack_from(mmap, pointer)
+        if record_type == b'GRUP':
+            raise TypeError(f'Group record must be of type Group, not {self.__class__.__name__}.')
+        self._type = sys.intern(record_type.decode('ascii'))
+        self._fields = None
+        self._field_lookup = None
+        self._values = None
+        self._edited_content = None
+        self._changed_records = None
+        self._strings = None
 
     @property
     def type(self):
-        return self._header[0:4].decode('ascii')
+        return self._type
 
     @property
     def size(self):
-        return _get_int(self._header[4:8])
+        return self._size
+
+    @property
+    def form_id(self) -> FormId:
+        return FormId(self._form_id.to_bytes(4, 'little'))
 
     def __len__(self):
-        if self._is_parsing_complete:
-            return len(self._pos)
-        else:
-            return len(self._get_all_fields())
+        return len(self._get_field_index()) // 3
 
     def __iter__(self):
         for field in self.get_all_fields():
@@ -48,70 +76,97 @@ class Record:
             if len(key) == 4 and key.upper() == key:
                 return self.get_field(key)
 
-    # TODO: Implement __setitem__ to allow changing the value of a field
+    def __setitem__(self, field_name: str, value: bytes):
+        """Change the content of the first field with the name, or add the field if there is none.
+
+        The changes are kept in memory. Use `ElderScrollsFile.save` to write them to a file.
+        """
+        if not isinstance(field_name, str) or len(field_name) != 4:
+            raise KeyError(f'Field names must be four characters long, for example EDID. Got: {field_name}')
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(f'Field content must be bytes, not {type(value)}')
+        fields = list(self._iter_field_contents())
+        for idx, (name, _) in enumerate(fields):
+            if name == field_name:
+                fields[idx] = (field_name, value)
+                break
+        else:
+            fields.append((field_name, value))
+        self._edited_content = _pack_fields(fields)
+        self._fields = None
+        self._field_lookup = None
+        self._values = None
+        if self._changed_records is not None:
+            self._changed_records[self._pointer] = self
+
     # TODO: Implement __enter__ and __exit__ to allow using the record in a with statement
 
     def __contains__(self, field: Union[Field, str]):
         if isinstance(field, Field):
-            if self._is_parsing_complete:
-                return field.name in self._field_positions
-            else:
-                return field.name in self.get_all_fields()
-        elif isinstance(field, str):
-            if self._is_parsing_complete:
-                return field in self._field_positions
-            else:
-                return field in self.get_all_fields()
+            field = field.name
+        if not isinstance(field, str):
+            return False
+        self._get_field_index()
+        return field in self._field_lookup
 
     def get_field(self, field_name: str) -> Field:
+        fields = self._get_field_index()
         try:
-            return self._get_field_at_position(self._field_positions[field_name][0])
+            idx = self._field_lookup[field_name][0]
         except KeyError:
-            if not self._is_parsing_complete:
-                return self._get_field(field_name)
-            else:
-                raise KeyError(f'Field {field_name} not found in record.')
+            raise KeyError(f'Field {field_name} not found in record.')
+        return self._get_field_at(fields[idx + 1], fields[idx + 2])
 
     def get_fields(self, field_name: str) -> Iterator[Field]:
-        if field_name in self._field_positions:
-            for pos in self._field_positions[field_name]:
-                field = self._get_field_at_position(pos)
-                yield field
-            pos += Field.header_size + field.size
-        else:
-            pos = self._pointer + self.header_size
-        if not self._is_parsing_complete:
-            for field in self._get_fields(field_name, pos):
-                yield field
+        fields = self._get_field_index()
+        for idx in self._field_lookup.get(field_name, ()):
+            yield self._get_field_at(fields[idx + 1], fields[idx + 2])
 
     def get_all_fields(self) -> Iterator[Field]:
-        if self._is_parsing_complete:
-            for pos in self._pos:
-                field = self._get_field_at_position(pos)
-                yield field
-        else:
-            for field in self._get_all_fields():
-                yield field
+        fields = self._get_field_index()
+        for position, size in zip(fields[1::3], fields[2::3]):
+            yield self._get_field_at(position, size)
 
     @property
-    def content(self) -> bytes:
-        if self.is_compressed:
-            try:
-                return self._uncompressed_content
-            except AttributeError:
-                start = self._pointer + self.header_size + 4
-                end = start + self.size
-                self._uncompressed_content = zlib.decompress(self._mmap[start:end],
-                                                             zlib.MAX_WBITS)
-                return self._uncompressed_content
+    def is_changed(self) -> bool:
+        return self._edited_content is not None
+
+    @property
+    def content(self) -> Union[bytes, memoryview]:
+        if self._edited_content is not None:
+            return self._edited_content
+        elif self.is_compressed:
+            return _inflate(self._mmap, self._pointer, self.size)
         else:
-            try:
-                return self._content
-            except AttributeError:
-                start = self._pointer + self.header_size
-                end = start + self.size
-                self._content = self._mmap[start:end]
-                return self._content
+            start = self._pointer + self.header_size
+            return memoryview(self._mmap)[start:start + self.size]
+
+    def _get_data(self) -> Tuple[memoryview, int, int]:
+        """Return the buffer to read the fields from, and the start and end positions of the fields in it.
+
+        For compressed or changed records, this is the content in memory, otherwise it is the file itself.
+        """
+        if self._edited_content is not None:
+            return memoryview(self._edited_content), 0, len(self._edited_content)
+        return _get_record_data(self._mmap, self._pointer, self._size, self._flags)
+
+    def _get_value(self, field_name: str):
+        """Return the value of the first field with the name, decoded as in FIELD_TYPES, or None if there is none.
+
+        Values are decoded once, and kept until the record is changed.
+        """
+        if self._values is None:
+            self._values = {}
+        try:
+            return self._values[field_name]
+        except KeyError:
+            pass
+        try:
+            value = self.get_field(field_name)(self._type)
+        except (KeyError, struct.error):
+            value = None
+        self._values[field_name] = value
+        return value
 
     @property
     def editor_id(self):
@@ -123,9 +178,13 @@ class Record:
     @property
     def full_name(self):
         try:
-            return str(self['FULL'])
+            full_name = self['FULL']
         except KeyError:
             return None
+        if self._strings:
+            # In localized plugins, the field is the ID of the name in the .STRINGS file.
+            return self._strings['strings'].get(int(full_name))
+        return str(full_name)
 
     @property
     def is_deleted(self):
@@ -139,62 +198,115 @@ class Record:
     def is_compressed(self):
         return self._get_flag(18)
 
+    def _to_bytes(self) -> bytes:
+        """Return the record as it is written to a file: the header, then the content, compressed if the record is."""
+        content = self.content
+        if self.is_compressed:
+            content = struct.pack('<I', len(content)) + zlib.compress(content)
+        header = list(_RECORD_HEADER.unpack_from(self._mmap, self._pointer))
+        header[1] = len(content)
+        return _RECORD_HEADER.pack(*header) + content
+
+    def _iter_field_contents(self) -> Iterator[Tuple[str, memoryview]]:
+        """Yield the name and content of every field, with the content of oversized fields in full.
+
+        A field larger than 65535 bytes is preceded by an XXXX field holding its size, and its own size is 0.
+        """
+        data, _, _ = self._get_data()
+        fields = self._get_field_index()
+        for fourcc, _pos, field_size in zip(fields[::3], fields[1::3], fields[2::3]):
+            yield _UINT.pack(fourcc).decode('ascii'), data[_pos:_pos + field_size]
+
     def _get_flag(self, bit):
         """Returns True if the flag is set, False if not."""
-        return _get_bit(self._header[8:12], bit)
-
-    def _get_field_at_position(self, position: int):
-        field_size = _get_int(self._mmap[position + 4:position + 6])
-        return Field(self._mmap[position:position + Field.header_size + field_size])
-
-    def _register_field(self, field_name: str, position: int):
-        if not self._is_parsing_complete and position not in self._pos:
-            if field_name in self._field_positions:
-                self._field_positions[field_name].append(position)
-                self._pos[position] = field_name
-            else:
-                self._field_positions[field_name] = [position]
-                self._pos[position] = field_name
-
-    def _get_field(self, field_name: str) -> Field:
-        _pos = self._pointer + self.header_size
-        while _pos < self._pointer + self.header_size + self.size:
-            field_name_at_pos = self._mmap[_pos:_pos + 4].decode('ascii')
-            self._register_field(field_name_at_pos, _pos)
-            field_size = _get_int(self._mmap[_pos + 4:_pos + 6])
-            if field_name == field_name_at_pos:
-                return Field(self._mmap[_pos:_pos + Field.header_size + field_size])
-            _pos += Field.header_size + field_size
-        self._is_parsing_complete = True
-
-
-    def _get_fields(self, field_name: str, starting_position: int=None) -> Iterator[Field]:
-        if starting_position is None:
-            _pos = self._pointer + self.header_size
+        return bool(self._flags & (1 << bit))
+
+    def _get_field_index(self) -> array:
+        """Return the name, position of the content and size of every field, as consecutive values in an array.
+
+        `_field_lookup` is filled at the same time, with the indices in the array of the fields of each name.
+        """
+        if self._fields is None:
+            data, start, end = self._get_data()
+            fields = array('I')
+            field_lookup = {}
+            for field_name, _pos, field_size in _iter_field_positions(data, start, end):
+                fourcc, = _UINT.unpack(field_name)
+                field_lookup.setdefault(field_name.decode('ascii'), []).append(len(fields))
+                fields.extend((fourcc, _pos, field_size))
+            # The lookup is set first, as the array is what other threads check for.
+            self._field_lookup = field_lookup
+            self._fields = fields
+        return self._fields
+
+    def _get_field_at(self, position: int, size: int) -> Field:
+        """Return the field with the content at the position. The size is the one from XXXX for oversized fields."""
+        data, _, _ = self._get_data()
+        header_position = position - Field.header_size
+        field = Field(data[header_position:position + size])
+        if field.size != size:
+            field.size = size
+            field.bytes = data[position:position + size]
+        return field
+
+
+def _inflate(_mmap: mmap.mmap, pointer: int, size: int) -> bytes:
+    """Return the inflated content of the compressed record at the position, from the cache if it is there."""
+    key = (_mmap, pointer)
+    try:
+        return _inflated_contents[key]
+    except KeyError:
+        # The content starts with the size of the inflated content.
+        start = pointer + Record.header_size + 4
+        content = zlib.decompress(_mmap[start:pointer + Record.header_size + size], zlib.MAX_WBITS)
+        _inflated_contents[key] = content
+        return content
+
+
+def _get_record_data(_mmap: mmap.mmap, pointer: int, size: int, flags: int) -> Tuple[memoryview, int, int]:
+    """Return the buffer holding the fields of the record at the position, and where they start and end in it."""
+    if flags & COMPRESSED_FLAG:
+        content = _inflate(_mmap, pointer, size)
+        return memoryview(content), 0, len(content)
+    start = pointer + Record.header_size
+    return memoryview(_mmap), start, start + size
+
+
+def _iter_field_positions(data: memoryview, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield the name, the position of the content and the size of every field, reading only their headers.
+
+    The size of an oversized field is taken from the XXXX field before it.
+    """
+    _pos = start
+    oversize = None
+    while _pos < end:
+        field_name, field_size = _FIELD_HEADER.unpack_from(data, _pos)
+        _pos += _FIELD_HEADER.size
+        if field_name == b'XXXX':
+            oversize, = _UINT.unpack_from(data, _pos)
+        else:
+            if oversize is not None:
+                field_size, oversize = oversize, None
+            yield field_name, _pos, field_size
+        _pos += field_size
+
+
+def _pack_fields(fields: Iterable[Tuple[str, bytes]]) -> bytes:
+    """Return the fields as they are written in a record, with an XXXX field before oversized ones."""
+    packed = []
+    for field_name, content in fields:
+        field_name = field_name.encode('ascii')
+        if len(content) > 0xffff:
+            packed.append(_FIELD_HEADER.pack(b'XXXX', 4) + struct.pack('<I', len(content)))
+            packed.append(_FIELD_HEADER.pack(field_name, 0))
         else:
-            _pos = starting_position
-        while _pos < self._pointer + self.header_size + self.size:
-            field_name_at_pos = self._mmap[_pos:_pos + 4].decode('ascii')
-            self._register_field(field_name_at_pos, _pos)
-            field_size = _get_int(self._mmap[_pos + 4:_pos + 6])
-            if field_name == field_name_at_pos:
-                yield Field(self._mmap[_pos:_pos + Field.header_size + field_size])
-            _pos += Field.header_size + field_size
-        if starting_position is None:
-            self._is_parsing_complete = True
-
-    def _get_all_fields(self) -> Iterator[Field]:
-        _pos = self._pointer + self.header_size
-        while _pos < self._pointer + self.header_size + self.size:
-            field_name_at_pos = self._mmap[_pos:_pos + 4].decode('ascii')
-            self._register_field(field_name_at_pos, _pos)
-            field_size = _get_int(self._mmap[_pos + 4:_pos + 6])
-            yield Field(self._mmap[_pos:_pos + Field.header_size + field_size])
-            _pos += Field.header_size + field_size
-        self._is_parsing_complete = True
+            packed.append(_FIELD_HEADER.pack(field_name, len(content)))
+        packed.append(bytes(content))
+    return b''.join(packed)
 
 
 class TES4(Record):
+    __slots__ = ('_masters',)
 
     @property
     def author(self):
@@ -216,64 +328,83 @@ class TES4(Record):
     def is_esl(self):
         return self._get_flag(9)
 
+    @property
+    def is_localized(self):
+        return self._get_flag(7)
+
 
 class NPC_(Record):
+    __slots__ = ()
+
+    @property
+    def acbs(self) -> Optional[Tuple]:
+        """The configuration of the NPC: flags, stat offsets, level and so on, decoded as in FIELD_TYPES."""
+        return self._get_value('ACBS')
+
+    def _get_acbs_flag(self, bit: int) -> Optional[bool]:
+        acbs = self.acbs
+        if acbs is None:
+            return None
+        return bool(acbs[0] & (1 << bit))
 
     @property
     def is_female(self):
-        return self._get_bit(self.acbs, 0)
+        return self._get_acbs_flag(0)
 
     @property
     def is_essential(self):
-        return self._get_bit(self.acbs, 1)
+        return self._get_acbs_flag(1)
 
     @property
     def is_preset(self):
-        return self._get_bit(self.acbs, 2)
+        return self._get_acbs_flag(2)
 
     @property
     def respawns(self):
-        return self._get_bit(self.acbs, 3)
+        return self._get_acbs_flag(3)
 
     @property
     def auto_calculate_stats(self):
-        return self._get_bit(self.acbs, 4)
+        return self._get_acbs_flag(4)
 
     @property
     def is_unique(self):
-        return self._get_bit(self.acbs, 5)
+        return self._get_acbs_flag(5)
 
     @property
     def is_levelling_up_with_pc(self):
-        return self._get_bit(self.acbs, 7)
+        return self._get_acbs_flag(7)
 
     @property
     def is_protected(self):
-        return self._get_bit(self.acbs, 11)
+        return self._get_acbs_flag(11)
 
     @property
     def is_summonable(self):
-        return self._get_bit(self.acbs, 14)
+        return self._get_acbs_flag(14)
 
     @property
     def has_opposite_gender_animations(self):
-        return self._get_bit(self.acbs, 19)
+        return self._get_acbs_flag(19)
 
     @property
     def is_ghost(self):
-        return self._get_bit(self.acbs, 29)
+        return self._get_acbs_flag(29)
 
     @property
     def is_invulnerable(self):
-        return self._get_bit(self.acbs, 31)
+        return self._get_acbs_flag(31)
 
     @property
     def level(self):
+        acbs = self.acbs
+        if acbs is None:
+            return None
         if self.is_levelling_up_with_pc:
             divider = 1000
         else:
             divider = 1
-        return int.from_bytes(self.acbs[8:10], 'little', signed=False) / divider
+        return acbs[3] / divider
 
     @property
     def face_geom_file_name(self) -> str:
@@ -304,5 +435,133 @@ class NPC_(Record):
                           self.face_tint_file_name])
 
 
+class _Item(Record):
+    """A record of an item that has a value and a weight, the first two values in its DATA field."""
+    __slots__ = ()
+
+    @property
+    def value(self) -> Optional[int]:
+        data = self._get_value('DATA')
+        return None if data is None else data[0]
+
+    @property
+    def weight(self) -> Optional[float]:
+        data = self._get_value('DATA')
+        return None if data is None else data[1]
+
+
+class WEAP(_Item):
+    __slots__ = ()
+
+    @property
+    def damage(self) -> Optional[int]:
+        data = self._get_value('DATA')
+        return None if data is None else data[2]
+
+
+class ARMO(_Item):
+    __slots__ = ()
+
+    @property
+    def armor_rating(self) -> Optional[float]:
+        """The armor rating, as it is shown in the game. It is stored multiplied by 100."""
+        armor_rating = self._get_value('DNAM')
+        return None if armor_rating is None else armor_rating / 100
+
+
 class BOOK(Record):
-    pass
\ No newline at end of file
+    __slots__ = ()
+
+    @property
+    def value(self) -> Optional[int]:
+        data = self._get_value('DATA')
+        return None if data is None else data[4]
+
+    @property
+    def weight(self) -> Optional[float]:
+        data = self._get_value('DATA')
+        return None if data is None else data[5]
+
+    @property
+    def teaches_skill(self) -> Optional[bool]:
+        return self._get_book_flag(0)
+
+    @property
+    def teaches_spell(self) -> Optional[bool]:
+        return self._get_book_flag(2)
+
+    def _get_book_flag(self, bit: int) -> Optional[bool]:
+        data = self._get_value('DATA')
+        if data is None:
+            return None
+        return bool(data[0] & (1 << bit))
+
+
+class MISC(_Item):
+    __slots__ = ()
+
+
+class KEYM(_Item):
+    __slots__ = ()
+
+
+class INGR(_Item):
+    __slots__ = ()
+
+
+class SLGM(_Item):
+    __slots__ = ()
+
+
+class ALCH(Record):
+    __slots__ = ()
+
+    @property
+    def weight(self) -> Optional[float]:
+        return self._get_value('DATA')
+
+
+# The class of each type of record, by the four character code at the start of its header.
+# Records of other types are plain Records.
+RECORD_CLASSES = {
+    b'TES4': TES4,
+    b'NPC_': NPC_,
+    b'WEAP': WEAP,
+    b'ARMO': ARMO,
+    b'BOOK': BOOK,
+    b'MISC': MISC,
+    b'KEYM': KEYM,
+    b'INGR': INGR,
+    b'SLGM': SLGM,
+    b'ALCH': ALCH,
+}
+
+
+def register_record_type(record_type: str, record_class: type):
+    """Add or change the class of the records of a type, for example register_record_type('CELL', Cell)."""
+    if not issubclass(record_class, Record):
+        raise TypeError(f'Record classes must be subclasses of Record, not {record_class.__name__}.')
+    RECORD_CLASSES[record_type.encode('ascii')] = record_class
+
+
+def _create_record(_mmap: mmap.mmap, pointer: int) -> Record:
+    """Return the record at the position, as an instance of the class of its type."""
+    return RECORD_CLASSES.get(_mmap[pointer:pointer + 4], Record)(_mmap, pointer)
+
+
+def _get_record(_mmap: mmap.mmap, pointer: int, changed_records: Optional[dict]=None,
+                strings: Optional[dict]=None) -> Record:
+    """Return the changed record at the position if it has been changed, otherwise a new record.
+
+    The new record adds itself to `changed_records` when it is changed, and looks up its full
+    name in the string tables in `strings`.
+    """
+    if changed_records is not None:
+        try:
+            return changed_records[pointer]
+        except KeyError:
+            pass
+    record = _create_record(_mmap, pointer)
+    record._changed_records = changed_records
+    record._strings = strings
+    return record
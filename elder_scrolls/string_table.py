@@ -0,0 +1,120 @@
+import os
+import struct
+from typing import Optional, Union
+
+from .lib import Loader, LRUCache, _get_str
+
+
+STRING_CACHE_SIZE = 1024 * 1024
+STRING_TABLE_EXTENSIONS = ('strings', 'dlstrings', 'ilstrings')
+
+# string count, data size
+_HEADER = struct.Struct('<II')
+# string ID, offset from the start of the data
+_DIRECTORY_ENTRY = struct.Struct('<II')
+_LENGTH = struct.Struct('<I')
+_SCAN_SIZE = 256
+
+
+class StringTable(Loader):
+    """Read the strings of a localized plugin, from a .STRINGS, .DLSTRINGS or .ILSTRINGS file.
+
+    Localized plugins (the TES4 flag 0x80) keep a 4-byte string ID in fields such as FULL and
+    DESC, instead of the text. The directory of the table is not decoded: string IDs are found
+    with a binary search in the memory map, and only the strings that are used are decoded,
+    and kept in a cache of up to `cache_size` characters. The directory is expected to be
+    sorted by string ID, as it is in the files of the game.
+
+    Usage example:
+
+    with StringTable(os.path.join(game_folder, 'Data', 'Strings', 'Skyrim_english.strings')) as strings:
+        print(strings[0x1a2b])
+
+    with BethesdaSoftwareArchive(os.path.join(game_folder, 'Data', 'Skyrim - Interface.bsa')) as archive:
+        strings = StringTable.from_archive(archive, 'Strings\\Skyrim_english.dlstrings')
+    """
+
+    def __init__(self, file_path: str, content: Optional[Union[bytes, memoryview]]=None,
+                 cache_size: int=STRING_CACHE_SIZE):
+        if content is None:
+            super().__init__(file_path)
+            content = self._mmap
+        else:
+            self.file_path = file_path
+            self.file_name = os.path.basename(file_path.replace('\\', os.sep))
+            self._file = None
+        self._data = memoryview(content)
+        try:
+            self.count, self.data_size = _HEADER.unpack_from(self._data)
+        except struct.error:
+            raise RuntimeError(f'Incorrect file header - is {self.file_path} a string table?')
+        self._data_start = _HEADER.size + self.count * _DIRECTORY_ENTRY.size
+        if self._data_start + self.data_size > len(self._data):
+            raise RuntimeError(f'The string table {self.file_path} is shorter than its header says.')
+        # .DLSTRINGS and .ILSTRINGS files have the length of each string before it.
+        self.has_lengths = not self.file_name.lower().endswith('.strings')
+        self._cache = LRUCache(cache_size)
+
+    @classmethod
+    def from_archive(cls, archive, path: str, cache_size: int=STRING_CACHE_SIZE) -> 'StringTable':
+        """Read a string table from a BSA archive. It is not copied unless it is compressed."""
+        return cls(path, archive.view(path), cache_size)
+
+    def __exit__(self, exception_type, exception_val, trace):
+        if self._file is not None:
+            self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, string_id: int):
+        return self._find(string_id) is not None
+
+    def __getitem__(self, string_id: int) -> str:
+        try:
+            return self._cache[string_id]
+        except KeyError:
+            pass
+        offset = self._find(string_id)
+        if offset is None:
+            raise KeyError(f'String ID {hex(string_id)} not found in {self.file_name}.')
+        string = self._decode(offset)
+        self._cache[string_id] = string
+        return string
+
+    def get(self, string_id: int, default: Optional[str]=None) -> Optional[str]:
+        try:
+            return self[string_id]
+        except KeyError:
+            return default
+
+    def _find(self, string_id: int) -> Optional[int]:
+        """Return the offset of the string from the start of the data, with a binary search in the directory."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            middle_id, offset = _DIRECTORY_ENTRY.unpack_from(self._data, _HEADER.size + middle * _DIRECTORY_ENTRY.size)
+            if middle_id < string_id:
+                low = middle + 1
+            elif middle_id > string_id:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def _decode(self, offset: int) -> str:
+        _pos = self._data_start + offset
+        if self.has_lengths:
+            length, = _LENGTH.unpack_from(self._data, _pos)
+            _pos += _LENGTH.size
+            return _get_str(self._data[_pos:_pos + length])
+        # The end of the string is found a piece at a time, so that the rest of the data is not copied.
+        end = _pos
+        while True:
+            piece = self._data[end:end + _SCAN_SIZE].tobytes()
+            null_position = piece.find(b'\x00')
+            if null_position >= 0:
+                return _get_str(self._data[_pos:end + null_position])
+            if not piece:
+                raise RuntimeError(f'The string at {offset} in {self.file_name} does not end.')
+            end += len(piece)
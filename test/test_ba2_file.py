@@ -0,0 +1,120 @@
+import struct
+import zlib
+
+import pytest
+from elder_scrolls.ba2_file import BethesdaArchive2
+
+
+GENERAL_FILES = {
+    'meshes\\actors\\character\\test.nif': b'NIF ' + bytes(3000),
+    'interface\\readme.txt': b'Hello from the archive.\r\n',
+    'strings\\fallout4_en.strings': b'\x02\x00\x00\x00' + b'strings-data' * 10,
+}
+TEXTURE = bytes(range(256)) * 40
+
+
+def _crc_hash(name: str) -> int:
+    crc_table = []
+    for idx in range(256):
+        value = idx
+        for _ in range(8):
+            value = (value >> 1) ^ 0xEDB88320 if value & 1 else value >> 1
+        crc_table.append(value)
+    value = 0
+    for char in name.encode():
+        value = (value >> 8) ^ crc_table[(value ^ char) & 0xff]
+    return value
+
+
+def _hashes(path: str):
+    folder_name, _, file_name = path.rpartition('\\')
+    base, _, ext = file_name.rpartition('.')
+    return _crc_hash(base), ext.encode().ljust(4, b'\x00'), _crc_hash(folder_name)
+
+
+def _write_ba2(file_path, archive_type, files, version=1, compress=None):
+    """Write a BA2 with general files, or with textures as {path: (width, height, DXGI format, mip chunks)}."""
+    header_size = 24 + {1: 0, 2: 8, 3: 12}[version]
+    if archive_type == b'GNRL':
+        records_size = 36 * len(files)
+    else:
+        records_size = sum(24 + 24 * len(chunks) for _, _, _, chunks in files.values())
+    data = bytearray()
+    records = bytearray()
+    _pos = header_size + records_size
+
+    def add_data(content):
+        nonlocal data
+        offset = _pos + len(data)
+        if compress is None:
+            data += content
+            return offset, 0, len(content)
+        packed = zlib.compress(content) if compress == 'zlib' else compress(content)
+        data += packed
+        return offset, len(packed), len(content)
+
+    for path, content in files.items():
+        name_hash, ext, folder_hash = _hashes(path)
+        if archive_type == b'GNRL':
+            offset, packed_size, original_size = add_data(content)
+            records += struct.pack('<I4sIIQIII', name_hash, ext, folder_hash, 0x100100,
+                                   offset, packed_size, original_size, 0xBAADF00D)
+        else:
+            width, height, dxgi_format, chunks = content
+            records += struct.pack('<I4sIBBHHHBBBB', name_hash, ext, folder_hash, 0, len(chunks), 24,
+                                   height, width, len(chunks), dxgi_format, 0, 8)
+            for mip, chunk in enumerate(chunks):
+                offset, packed_size, original_size = add_data(chunk)
+                records += struct.pack('<QIIHHI', offset, packed_size, original_size, mip, mip, 0xBAADF00D)
+    names = b''.join(struct.pack('<H', len(path)) + path.encode() for path in files)
+    header = b'BTDX' + struct.pack('<I4sIQ', version, archive_type, len(files), _pos + len(data))
+    if version >= 2:
+        header += struct.pack('<II', 1, 0)
+    if version == 3:
+        header += struct.pack('<I', 3 if compress not in (None, 'zlib') else 0)
+    with open(file_path, 'wb') as ba2:
+        ba2.write(header + records + data + names)
+
+
+@pytest.mark.parametrize('version, compress', [(1, None), (1, 'zlib'), (3, 'lz4')])
+def test_general_archive(version, compress, tmp_path):
+    if compress == 'lz4':
+        lz4_block = pytest.importorskip('lz4.block')
+        compress = lambda content: lz4_block.compress(content, store_size=False)
+    _write_ba2(tmp_path / 'test.ba2', b'GNRL', GENERAL_FILES, version, compress)
+    with BethesdaArchive2(str(tmp_path / 'test.ba2')) as archive:
+        assert archive.archive_type == 'GNRL'
+        assert len(archive) == len(GENERAL_FILES)
+        assert archive.file_names == list(GENERAL_FILES)
+        for path, content in GENERAL_FILES.items():
+            assert path.upper() in archive
+            assert archive[path.replace('\\', '/')] == content
+        assert archive['Interface', 'ReadMe.txt'] == GENERAL_FILES['interface\\readme.txt']
+        with archive.open('interface\\readme.txt') as readme:
+            assert readme.readline() == b'Hello from the archive.\r\n'
+        assert 'interface\\missing.txt' not in archive
+        with pytest.raises(FileNotFoundError):
+            archive['interface\\missing.txt']
+
+
+def test_texture_archive(tmp_path):
+    chunks = [TEXTURE[:8192], TEXTURE[8192:10240]]
+    files = {
+        'textures\\test\\bc1.dds': (128, 128, 71, chunks),
+        'textures\\test\\bc7.dds': (64, 128, 98, [TEXTURE[:8192]]),
+    }
+    _write_ba2(tmp_path / 'textures.ba2', b'DX10', files, compress='zlib')
+    with BethesdaArchive2(str(tmp_path / 'textures.ba2')) as archive:
+        assert archive.archive_type == 'DX10'
+        with archive.open('Textures/Test/BC1.dds') as texture:
+            magic, size, flags, height, width, linear_size, _, mip_count = struct.unpack('<4s7I', texture.read(32))
+            assert (magic, size, height, width, mip_count) == (b'DDS ', 124, 128, 128, 2)
+            assert linear_size == 32 * 32 * 8
+            assert texture.read(56)[-4:] == b'DXT1'
+            texture.read(40)
+            assert texture.read() == b''.join(chunks)
+
+        bc7 = archive['textures\\test\\bc7.dds']
+        assert bc7[84:88] == b'DX10'
+        assert struct.unpack_from('<I', bc7, 128)[0] == 98
+        assert bc7[148:] == TEXTURE[:8192]
@@ -0,0 +1,258 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from elder_scrolls import DataFolder, bsa_file
+from elder_scrolls.bsa_file import BethesdaSoftwareArchive, hash_paths
+from elder_scrolls.bsa_packer import pack_archive
+
+
+TEST_FILES = {
+    'strings\\skyrim_english.strings': b'\x02\x00\x00\x00' + b'strings-data' * 10,
+    'textures\\actors\\character\\facegendata\\facetint\\test.esp\\00000800.dds': bytes(range(256)) * 40,
+    'textures\\actors\\character\\facegendata\\facetint\\test.esp\\00000801.dds': b'tint' * 500,
+    'meshes\\actors\\character\\facegendata\\facegeom\\test.esp\\00000800.nif': b'NIF ' + bytes(3000),
+    'interface\\readme.txt': b'Hello from the archive.\r\n',
+}
+
+
+TEXTURE_FILES = [content for path, content in TEST_FILES.items() if path.endswith('.dds')]
+
+
+def test_open_archive():
+    with BethesdaSoftwareArchive('./bsa/test_v105.bsa') as archive:
+        assert archive.version == 105
+        assert archive.file_count == 5
+        assert set(archive.folder_names) == {path.rpartition('\\')[0] for path in TEST_FILES}
+
+
+@pytest.mark.parametrize('file_name', ['test_v105.bsa', 'test_v104_zlib.bsa', 'test_v105_lz4.bsa'])
+def test_read_files(file_name):
+    if 'lz4' in file_name:
+        pytest.importorskip('lz4')
+    with BethesdaSoftwareArchive(f'./bsa/{file_name}') as archive:
+        for path, content in TEST_FILES.items():
+            assert archive[path] == content
+            folder_name, _, name = path.rpartition('\\')
+            assert archive[folder_name, name.upper()] == content
+        assert archive['Strings', 'Skyrim_English.STRINGS'] == TEST_FILES['strings\\skyrim_english.strings']
+
+
+@pytest.mark.parametrize('file_name', ['test_v105.bsa', 'test_v104_zlib.bsa', 'test_v105_lz4.bsa'])
+def test_open_file_in_archive(file_name):
+    if 'lz4' in file_name:
+        pytest.importorskip('lz4')
+    path = 'textures/actors/character/facegendata/facetint/test.esp/00000800.dds'
+    with BethesdaSoftwareArchive(f'./bsa/{file_name}') as archive:
+        with archive.open(path) as texture:
+            chunks = []
+            while True:
+                chunk = texture.read(100)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        assert b''.join(chunks) == TEST_FILES[path.replace('/', '\\')]
+
+        with archive.open(('Interface', 'readme.txt')) as readme:
+            assert readme.readline() == b'Hello from the archive.\r\n'
+
+
+def test_contains():
+    with BethesdaSoftwareArchive('./bsa/test_v104_zlib.bsa') as archive:
+        for path in TEST_FILES:
+            assert path in archive
+            assert path.upper().replace('\\', '/') in archive
+            assert path.rpartition('\\')[0] in archive
+        assert ('Interface', 'readme.txt') in archive
+        assert 'interface\\missing.txt' not in archive
+        assert 'missing\\readme.txt' not in archive
+        assert 'strings\\skyrim_english.dlstrings' not in archive
+        assert 'readme.txt' not in archive
+        assert '/readme.txt' not in archive
+        assert ('', 'readme.txt') not in archive
+        with pytest.raises(FileNotFoundError):
+            archive['interface\\missing.txt']
+        with pytest.raises(FileNotFoundError):
+            archive['readme.txt']
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_hash_paths(use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(bsa_file, 'np', None)
+    paths = [path.replace('\\', '/').upper() for path in TEST_FILES] + \
+        ['a/b', 'ab/cd.e', 'x/.kf', 'readme.txt', '/meshes/a.NIF/', 'x\\..dds', 'x/y/...', 'Déjà/vu.wav',
+         'a/b.c.kf', 'a/bc', '', '\\']
+    folder_hashes, file_hashes = hash_paths(paths)
+    assert len(folder_hashes) == len(file_hashes) == len(paths)
+    for path, folder_hash, file_hash in zip(paths, folder_hashes, file_hashes):
+        folder_name, _, file_name = path.lower().replace('/', '\\').strip('\\').rpartition('\\')
+        assert folder_hash == BethesdaSoftwareArchive._calculate_hash(folder_name)
+        assert file_hash == BethesdaSoftwareArchive._calculate_hash(file_name, is_file=True)
+    with BethesdaSoftwareArchive('./bsa/test_v105.bsa') as archive:
+        for folder_hash, file_hash in zip(folder_hashes[:len(TEST_FILES)], file_hashes):
+            assert (int(folder_hash), int(file_hash)) in archive._get_file_record_indices()
+    assert [len(column) for column in hash_paths([])] == [0, 0]
+
+
+def test_data_folder(tmp_path):
+    shutil.copy('./bsa/test_v105.bsa', tmp_path / 'a.bsa')
+    shutil.copy('./bsa/test_v104_zlib.bsa', tmp_path / 'b.bsa')
+    os.makedirs(tmp_path / 'Interface')
+    (tmp_path / 'Interface' / 'ReadMe.txt').write_bytes(b'Loose file.')
+    (tmp_path / 'Interface' / 'loose only.txt').write_bytes(b'Loose only.')
+    with DataFolder(str(tmp_path)) as data_folder:
+        assert [archive.file_name for archive in data_folder.archives] == ['a.bsa', 'b.bsa']
+        assert len(data_folder) == len(TEST_FILES) + 1
+        for path, content in TEST_FILES.items():
+            assert data_folder.exists(path.upper())
+            if path != 'interface\\readme.txt':
+                assert data_folder.get_archive(path).file_name == 'b.bsa'
+                with data_folder.open(path) as archived_file:
+                    assert archived_file.read() == content
+        assert data_folder.get_archive('interface/readme.txt') is None
+        with data_folder.open('interface/readme.txt') as loose_file:
+            assert loose_file.read() == b'Loose file.'
+        assert 'interface\\loose only.txt' in data_folder
+        assert not data_folder.exists('interface\\missing.txt')
+        assert not data_folder.exists('readme.txt')
+        with pytest.raises(FileNotFoundError):
+            data_folder.open('interface\\missing.txt')
+
+    with DataFolder(str(tmp_path), ['b.bsa', 'a.bsa']) as data_folder:
+        assert data_folder.get_archive(next(iter(TEST_FILES))).file_name == 'a.bsa'
+
+
+@pytest.mark.parametrize('file_name', ['test_v105.bsa', 'test_v104_zlib.bsa', 'test_v105_lz4.bsa'])
+def test_extract_all(file_name, tmp_path):
+    if 'lz4' in file_name:
+        pytest.importorskip('lz4')
+    with BethesdaSoftwareArchive(f'./bsa/{file_name}') as archive:
+        report = archive.extract_all(str(tmp_path / 'all'), workers=4)
+        assert report['file_count'] == len(TEST_FILES)
+        assert report['size'] == sum(map(len, TEST_FILES.values()))
+        for path, content in TEST_FILES.items():
+            assert (tmp_path / 'all' / path.replace('\\', os.sep)).read_bytes() == content
+
+        report = archive.extract_all(str(tmp_path / 'textures'), filter='Textures/*.dds')
+        assert report['file_count'] == 2
+        assert sorted(path.name for path in (tmp_path / 'textures').rglob('*') if path.is_file()) == \
+            ['00000800.dds', '00000801.dds']
+
+
+@pytest.mark.parametrize('folder_name', [b'..\\..', b'C:\\qq', b'\\zzqq'])
+def test_extract_all_outside_of_dest(folder_name, tmp_path):
+    (tmp_path / 'Data' / 'zz' / 'qq').mkdir(parents=True)
+    (tmp_path / 'Data' / 'zz' / 'qq' / 'evil.txt').write_bytes(b'evil')
+    archive_path = tmp_path / 'crafted.bsa'
+    pack_archive(str(tmp_path / 'Data'), str(archive_path), version=104, compress=False)
+    content = archive_path.read_bytes()
+    assert content.count(b'zz\\qq\x00') == 1
+    archive_path.write_bytes(content.replace(b'zz\\qq\x00', folder_name + b'\x00'))
+
+    dest = tmp_path / 'a' / 'b'
+    with BethesdaSoftwareArchive(str(archive_path)) as archive:
+        with pytest.raises(RuntimeError):
+            archive.extract_all(str(dest))
+    assert not [path for path in tmp_path.rglob('evil.txt') if 'Data' not in path.parts]
+
+
+@pytest.mark.parametrize('version, compress', [(104, False), (104, True), (105, False), (105, True)])
+def test_pack_archive(version, compress, tmp_path):
+    if version == 105 and compress:
+        pytest.importorskip('lz4')
+    for path, content in TEST_FILES.items():
+        file_path = tmp_path / 'Data' / path.replace('\\', os.sep)
+        os.makedirs(file_path.parent, exist_ok=True)
+        file_path.write_bytes(content)
+    archive_path = str(tmp_path / 'packed.bsa')
+
+    assert pack_archive(str(tmp_path / 'Data'), archive_path, version=version, compress=compress, workers=2) == len(TEST_FILES)
+
+    with BethesdaSoftwareArchive(archive_path) as archive:
+        assert archive.version == version
+        assert archive.is_compressed_by_default == compress
+        assert archive.contains_meshes and archive.contains_textures
+        assert list(archive._folder_hashes) == sorted(archive._folder_hashes)
+        for folder in archive.folders:
+            first_file = archive._folder_first_files[folder.index]
+            file_hashes = archive._file_hashes[first_file:first_file + len(folder)]
+            assert list(file_hashes) == sorted(file_hashes)
+        for path, content in TEST_FILES.items():
+            assert archive[path] == content
+        if compress:
+            assert archive._get_file_record_by_name('textures\\actors\\character\\facegendata\\facetint\\test.esp',
+                                                    '00000801.dds')['is_compressed']
+            assert not archive._get_file_record_by_name('interface', 'readme.txt')['is_compressed']
+
+
+def test_folder():
+    with BethesdaSoftwareArchive('./bsa/test_v104_zlib.bsa') as archive:
+        folder = archive['textures\\actors\\character\\facegendata\\facetint\\test.esp']
+        assert len(folder) == 2
+        assert sorted(folder) == ['00000800.dds', '00000801.dds']
+        assert '00000800.DDS' in folder
+        assert 'missing.dds' not in folder
+        texture = folder['00000801.dds']
+        assert texture.name == '00000801.dds'
+        assert texture.is_compressed
+        assert texture.read() == TEXTURE_FILES[1]
+        with texture.open() as texture_file:
+            assert texture_file.read(4) == b'tint'
+        assert [file.name for file in (folder[0], folder[-1])] == list(folder)
+        with pytest.raises(FileNotFoundError):
+            folder['missing.dds']
+        with pytest.raises(IndexError):
+            folder[2]
+
+
+@pytest.mark.parametrize('file_name', ['test_v105.bsa', 'test_v104_zlib.bsa', 'test_v105_lz4.bsa'])
+def test_view(file_name):
+    if 'lz4' in file_name:
+        pytest.importorskip('lz4')
+    with BethesdaSoftwareArchive(f'./bsa/{file_name}') as archive:
+        readme = archive.view('interface\\readme.txt')
+        assert isinstance(readme, memoryview)
+        assert readme == TEST_FILES['interface\\readme.txt']
+        assert readme.obj is archive._mmap
+        assert archive[0:4] == b'BSA\x00'
+
+    # A new archive, so that the lookups of the threads are its first ones.
+    with BethesdaSoftwareArchive(f'./bsa/{file_name}') as archive:
+        paths = list(TEST_FILES) * 50
+        barrier = threading.Barrier(8)
+
+        def view_files(paths):
+            barrier.wait()
+            return [bytes(archive.view(path)) for path in paths]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            contents = sum(executor.map(view_files, [paths[idx::8] for idx in range(8)]), [])
+        assert sorted(contents) == sorted(TEST_FILES[path] for path in paths)
+
+
+def test_view_from_threads(tmp_path):
+    """The first lookups in a new archive are made from many threads at once, while the lazy tables are built."""
+    for idx in range(20000):
+        file_path = tmp_path / 'Data' / f'folder{idx % 20}' / f'file{idx}.txt'
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(b'%d' % idx)
+    pack_archive(str(tmp_path / 'Data'), str(tmp_path / 'many.bsa'), version=104, compress=False)
+
+    thread_count = 8
+    for _ in range(5):
+        with BethesdaSoftwareArchive(str(tmp_path / 'many.bsa')) as archive:
+            barrier = threading.Barrier(thread_count)
+
+            def view_files(thread_idx):
+                barrier.wait()
+                return [bytes(archive.view(f'folder{idx % 20}\\file{idx}.txt'))
+                        for idx in range(thread_idx, 20000, 997)]
+
+            with ThreadPoolExecutor(max_workers=thread_count) as executor:
+                results = list(executor.map(view_files, range(thread_count)))
+        assert results == [[b'%d' % idx for idx in range(thread_idx, 20000, 997)] for thread_idx in range(thread_count)]
@@ -1,8 +1,68 @@
+import os
+import shutil
+import struct
+from array import array
+
 import pytest
-from elder_scrolls import ElderScrollsFile, Record
+from elder_scrolls import ElderScrollsFile, LoadOrder, Record
+from elder_scrolls import elder_scrolls_file
+from elder_scrolls.group import Group
+from elder_scrolls.record import ALCH, ARMO, BOOK, MISC, RECORD_CLASSES, WEAP, register_record_type, _inflated_contents
 from .conftest import SKYRIM_FULL_PATH
 
 
+def _field(name: bytes, content: bytes) -> bytes:
+    return name + struct.pack('<H', len(content)) + content
+
+
+def _record(record_type: bytes, form_id: int, *fields: bytes, flags: int=0) -> bytes:
+    content = b''.join(fields)
+    return record_type + struct.pack('<IIIIHH', len(content), flags, form_id, 0, 44, 0) + content
+
+
+def _group(label: bytes, group_type: int, *children: bytes) -> bytes:
+    content = b''.join(children)
+    return b'GRUP' + struct.pack('<I4sIHHI', 24 + len(content), label, group_type, 0, 0, 0) + content
+
+
+def _write_plugin(file_path, masters, *records: bytes, flags: int=0):
+    """Write a plugin with the masters and the records, each in its own top-level group."""
+    master_fields = [_field(b'MAST', master.encode() + b'\x00') + _field(b'DATA', bytes(8)) for master in masters]
+    with open(file_path, 'wb') as esp:
+        esp.write(_record(b'TES4', 0,
+                          _field(b'HEDR', struct.pack('<fII', 1.7, 2 * len(records), 0x900)),
+                          _field(b'CNAM', b'Author\x00'),
+                          *master_fields,
+                          flags=flags))
+        for record in records:
+            esp.write(_group(record[:4], 0, record))
+
+
+def _write_nested_esp(file_path):
+    """Write a plugin with a worldspace, an exterior cell with placed references, and a topic."""
+    with open(file_path, 'wb') as esp:
+        esp.write(_record(b'TES4', 0,
+                          _field(b'HEDR', struct.pack('<fII', 1.7, 12, 0x900)),
+                          _field(b'CNAM', b'Nested Author\x00'),
+                          flags=0x200))
+        esp.write(_group(b'WRLD', 0,
+                         _record(b'WRLD', 0x800, _field(b'EDID', b'TestWorld\x00')),
+                         _group(struct.pack('<I', 0x800), 1,
+                                _group(struct.pack('<hh', -1, 2), 4,
+                                       _group(struct.pack('<hh', -1, 5), 5,
+                                              _record(b'CELL', 0x801, _field(b'EDID', b'TestCell\x00')),
+                                              _group(struct.pack('<I', 0x801), 6,
+                                                     _group(struct.pack('<I', 0x801), 8,
+                                                            _record(b'REFR', 0x802)),
+                                                     _group(struct.pack('<I', 0x801), 9,
+                                                            _record(b'REFR', 0x803),
+                                                            _record(b'ACHR', 0x804))))))))
+        esp.write(_group(b'DIAL', 0,
+                         _record(b'DIAL', 0x805),
+                         _group(struct.pack('<I', 0x805), 7,
+                                _record(b'INFO', 0x806))))
+
+
 def test_file_not_found():
     """Test if FileNotFoundError is raised when trying to open a file that does not exist."""
     with pytest.raises(FileNotFoundError):
@@ -19,49 +79,36 @@ def test_open_file():
 @pytest.mark.depends(on=['test_open_file'])
 def test_record_parsing():
     with ElderScrollsFile('./esp/test_basic_esp_functionality.esp') as test_file:
+        expected_fields = ['HEDR', 'CNAM', 'SNAM', 'MAST', 'DATA', 'MAST', 'DATA', 'MAST', 'DATA', 'MAST', 'DATA']
+        expected_positions = [30, 48, 66, 109, 126, 140, 160, 174, 196, 210, 231]
+
         header_record = Record(test_file._mmap, 0)
         assert header_record._pointer == 0
         assert header_record.size == 215
+        assert header_record._fields is None
         assert header_record.get_field('HEDR')
-        assert header_record._is_parsing_complete == False
-        assert header_record._pos == {24: 'HEDR'}
-        assert header_record._field_positions == {'HEDR': [24]}
-
-        header_record = Record(test_file._mmap, 0)
+        assert [name.to_bytes(4, 'little').decode() for name in header_record._fields[::3]] == expected_fields
+        assert list(header_record._fields[1::3]) == expected_positions
+        assert header_record._fields[2] == 12
+        assert header_record._field_lookup['MAST'] == [9, 15, 21, 27]
+        assert header_record._field_lookup['HEDR'] == [0]
+        fields = header_record._fields
         assert 'Test Author' == str(header_record.get_field('CNAM'))
-        assert header_record._is_parsing_complete == False
-        assert header_record._pos == {24: 'HEDR', 42: 'CNAM'}
-        assert header_record._field_positions == {'CNAM': [42], 'HEDR': [24]}
+        assert header_record._fields is fields
 
         header_record = Record(test_file._mmap, 0)
         assert ['Skyrim.esm', 'Dawnguard.esm', 'HearthFires.esm', 'Dragonborn.esm'] == [str(f) for f in header_record.get_fields('MAST')]
         assert ['Skyrim.esm', 'Dawnguard.esm', 'HearthFires.esm', 'Dragonborn.esm'] == [f() for f in header_record.get_fields('MAST')]
-
-        header_record = Record(test_file._mmap, 0)
         assert 'Test Author' == str(header_record.get_field('CNAM'))
-        assert ['Skyrim.esm', 'Dawnguard.esm', 'HearthFires.esm', 'Dragonborn.esm'] == [str(f) for f in header_record.get_fields('MAST')]
-
-        header_record = Record(test_file._mmap, 0)
-        expected_fields = ['HEDR', 'CNAM', 'SNAM', 'MAST', 'DATA', 'MAST', 'DATA', 'MAST', 'DATA', 'MAST', 'DATA']
-        expected_positions = {24: 'HEDR', 42: 'CNAM', 60: 'SNAM', 103: 'MAST', 120: 'DATA', 134: 'MAST', 154: 'DATA', 168: 'MAST', 190: 'DATA', 204: 'MAST', 225: 'DATA'}
-        expected_field_positions = {'HEDR': [24], 'CNAM': [42], 'SNAM': [60], 'MAST': [103, 134, 168, 204], 'DATA': [120, 154, 190, 225]}
-
-        header_record = Record(test_file._mmap, 0)
-        assert header_record._is_parsing_complete == False
-        assert expected_fields == [f.name for f in header_record._get_all_fields()]
-        assert header_record._is_parsing_complete == True
-        assert header_record._pos == expected_positions
-        assert header_record._field_positions == expected_field_positions
+        assert 'SNAM' in header_record and 'XCLC' not in header_record
+        with pytest.raises(KeyError):
+            header_record.get_field('XCLC')
 
         header_record = Record(test_file._mmap, 0)
-        assert header_record._is_parsing_complete == False
-        assert expected_fields == [f.name for f in header_record.get_all_fields()]
-        assert header_record._is_parsing_complete == True
-        assert len(header_record._pos) == 11
+        assert len(header_record) == 11
         assert expected_fields == [f.name for f in header_record.get_all_fields()]
-        assert len(header_record._pos) == 11
         assert expected_fields == [f.name for f in header_record.get_all_fields()]
-        assert len(header_record._pos) == 11
+        assert len(header_record._fields) == 3 * 11
 
         header_record = Record(test_file._mmap, 0)
         assert expected_fields == [f.name for f in header_record]
@@ -77,6 +124,118 @@ def test_fields():
         assert str(field) == 'š™Ù?"\x00\x00\x00\n\x08'
 
 
+def test_field_types(tmp_path):
+    with ElderScrollsFile('./esp/test_basic_esp_functionality.esp') as test_file:
+        hedr = test_file.header_record.get_field('HEDR')
+        version, record_count, next_object_id = hedr()
+        assert version == pytest.approx(1.7)
+        assert (record_count, next_object_id) == (34, 0x80a)
+        assert float(hedr) == pytest.approx(1.7)
+        assert test_file.header_record.get_field('CNAM')() == 'Test Author'
+
+    acbs = struct.pack('<IhhHHHHhHhH', 0x21, 10, 20, 5, 1, 50, 100, 35, 0, -5, 0)
+    _write_plugin(tmp_path / 'npcs.esp', [], _record(b'WEAP', 0x803, _field(b'DATA', struct.pack('<IfH', 25, 9.0, 7))))
+    with open(tmp_path / 'npcs.esp', 'ab') as esp:
+        esp.write(_group(b'NPC_', 0,
+                         _record(b'NPC_', 0x800, _field(b'EDID', b'First\x00'), _field(b'ACBS', acbs)),
+                         _record(b'NPC_', 0x801, _field(b'EDID', b'NoStats\x00')),
+                         _record(b'NPC_', 0x802, _field(b'ACBS', acbs[:8] + struct.pack('<H', 7) + acbs[10:]))))
+    with ElderScrollsFile(str(tmp_path / 'npcs.esp'), use_index_file=False) as test_file:
+        assert test_file[0x800]['ACBS']('NPC_') == (0x21, 10, 20, 5, 1, 50, 100, 35, 0, -5, 0)
+        levels = [None if stats is None else stats[3] for stats in test_file.get_field_values('NPC_', 'ACBS')]
+        assert levels == [5, None, 7]
+        assert test_file.get_field_values('NPC_', 'EDID') == ['First', 'NoStats', None]
+        assert test_file.get_field_values('WEAP', 'DATA') == [(25, 9.0, 7)]
+
+
+def test_query(tmp_path):
+    essential = struct.pack('<IhhHHHHhHhH', 0x2, 0, 0, 12, 1, 50, 100, 35, 0, 0, 0)
+    levelled = struct.pack('<IhhHHHHhHhH', 0x80, 0, 0, 1500, 1, 50, 100, 35, 0, 0, 0)
+    _write_plugin(tmp_path / 'npcs.esp', [])
+    with open(tmp_path / 'npcs.esp', 'ab') as esp:
+        esp.write(_group(b'NPC_', 0,
+                         _record(b'NPC_', 0x800, _field(b'ACBS', essential), _field(b'EDID', b'Guard\x00')),
+                         _record(b'NPC_', 0x801, _field(b'EDID', b'Bandit\x00'), _field(b'ACBS', levelled)),
+                         _record(b'NPC_', 0x802, _field(b'EDID', b'NoStats\x00')),
+                         _record(b'NPC_', 0x803, _field(b'XXXX', struct.pack('<I', 3)), _field(b'DATA', b''),
+                                 b'abc', _field(b'ACBS', essential))))
+    with ElderScrollsFile(str(tmp_path / 'npcs.esp'), use_index_file=False) as test_file:
+        is_essential = lambda acbs: acbs[0] & 0x2
+        assert list(test_file.query('NPC_', where={'ACBS': is_essential}, select=['form_id', 'EDID'])) == \
+            [(0x800, 'Guard'), (0x803, None)]
+        assert list(test_file.query('NPC_')) == [('Guard',), ('Bandit',), ('NoStats',), (None,)]
+        assert list(test_file.query('NPC_', where={'EDID': lambda edid: edid.startswith('B')}, select=['ACBS'])) == \
+            [(struct.unpack('<IhhHHHHhHhH', levelled),)]
+
+        test_file[0x800]['EDID'] = b'Changed\x00'
+        assert list(test_file.query('NPC_', where={'ACBS': is_essential})) == [('Changed',), (None,)]
+
+        guard = test_file[0x800]
+        assert guard.is_essential and not guard.is_female
+        assert guard.level == 12
+        bandit = test_file[0x801]
+        assert bandit.is_levelling_up_with_pc
+        assert bandit.level == 1.5
+        assert test_file[0x802].acbs is None
+        assert test_file[0x802].level is None
+        assert test_file[0x802].is_essential is None
+        oversized = test_file[0x803]
+        assert [field.name for field in oversized] == ['DATA', 'ACBS']
+        assert bytes(oversized['DATA'].bytes) == b'abc' and oversized['DATA'].size == 3
+        assert oversized.is_essential
+
+
+def test_record_classes(tmp_path):
+    _write_plugin(tmp_path / 'items.esp', [],
+                  _record(b'WEAP', 0x800, _field(b'DATA', struct.pack('<IfH', 25, 9.0, 7))),
+                  _record(b'ARMO', 0x801, _field(b'DATA', struct.pack('<if', 125, 30.0)),
+                          _field(b'DNAM', struct.pack('<i', 2500))),
+                  _record(b'BOOK', 0x802, _field(b'DATA', struct.pack('<BBHIIf', 0x4, 0, 0, 0x12fcd, 45, 1.0))),
+                  _record(b'ALCH', 0x803, _field(b'DATA', struct.pack('<f', 0.5))),
+                  _record(b'MISC', 0x804, _field(b'EDID', b'Junk\x00')),
+                  _record(b'LVLI', 0x805))
+    with ElderScrollsFile(str(tmp_path / 'items.esp'), use_index_file=False) as test_file:
+        weapon, armor, book, potion, junk, levelled_list = (test_file[form_id] for form_id in range(0x800, 0x806))
+        assert [type(record) for record in (weapon, armor, book, potion, junk, levelled_list)] == \
+            [WEAP, ARMO, BOOK, ALCH, MISC, Record]
+        assert (weapon.value, weapon.weight, weapon.damage) == (25, 9.0, 7)
+        assert (armor.value, armor.weight, armor.armor_rating) == (125, 30.0, 25.0)
+        assert (book.value, book.teaches_spell, book.teaches_skill) == (45, True, False)
+        assert potion.weight == 0.5
+        assert junk.value is None
+        assert [type(record) for record in test_file['WEAP']] == [WEAP]
+
+        assert weapon._values == {'DATA': (25, 9.0, 7)}
+        weapon['DATA'] = struct.pack('<IfH', 30, 9.0, 8)
+        assert (weapon.value, weapon.damage) == (30, 8)
+
+        armor_group = test_file.get_group('ARMO')
+        with pytest.raises(KeyError):
+            test_file.get_group('NPC_')
+        assert [type(record) for record in armor_group._get_all_records()] == [ARMO]
+        group_armor, = armor_group._get_all_records()
+        group_armor['DNAM'] = struct.pack('<i', 3000)
+        assert next(armor_group._get_all_records()) is group_armor
+        assert test_file[0x801] is group_armor
+        test_file.save(str(tmp_path / 'changed.esp'))
+    with ElderScrollsFile(str(tmp_path / 'changed.esp'), use_index_file=False) as changed_file:
+        assert changed_file[0x801].armor_rating == 30.0
+        assert changed_file[0x800].damage == 8
+
+    register_record_type('LVLI', LVLI)
+    try:
+        with ElderScrollsFile(str(tmp_path / 'items.esp'), use_index_file=False) as test_file:
+            assert type(test_file[0x805]) is LVLI
+    finally:
+        del RECORD_CLASSES[b'LVLI']
+    with pytest.raises(TypeError):
+        register_record_type('LVLI', object)
+
+
+class LVLI(Record):
+    __slots__ = ()
+
+
 @pytest.mark.depends(on=['test_record_parsing'])
 def test_header_record():
     with ElderScrollsFile('./esp/test_basic_esp_functionality.esp') as test_file:
@@ -93,6 +252,207 @@ def test_header_record():
         assert test_file.record_count == 34
 
 
+@pytest.mark.depends(on=['test_header_record'])
+def test_records_by_type():
+    with ElderScrollsFile('./esp/test_basic_esp_functionality.esp') as test_file:
+        assert test_file.record_types == {'BOOK', 'NPC_', 'TXST', 'ARMO', 'DIAL', 'KYWD',
+                                          'ARMA', 'INGR', 'LVLI', 'QUST', 'WEAP', 'OTFT'}
+        assert test_file._groups['KYWD'] == (239, 138)
+        assert len(test_file['BOOK']) == 7
+        assert {r.type for r in test_file['NPC_']} == {'NPC_'}
+        assert [r._pointer for r in test_file['KYWD']] == [263, 320]
+        assert test_file['TREE'] == []
+
+
+@pytest.mark.depends(on=['test_header_record'])
+def test_records_by_form_id(tmp_path):
+    file_path = str(tmp_path / 'test_basic_esp_functionality.esp')
+    shutil.copy('./esp/test_basic_esp_functionality.esp', file_path)
+    with ElderScrollsFile(file_path) as test_file:
+        assert test_file[0x1acc8].type == 'BOOK'
+        assert test_file['0x4000800'].type == 'NPC_'
+        assert test_file[test_file[0x4000800].form_id]._pointer == test_file[0x4000800]._pointer
+        with pytest.raises(KeyError):
+            test_file[0x1acc7]
+    assert os.path.exists(file_path + '.idx')
+
+    with ElderScrollsFile(file_path) as test_file:
+        test_file._build_form_id_index = None  # The index must come from the index file.
+        assert test_file[0x1acc8].type == 'BOOK'
+        assert len(test_file._form_ids) == 22
+
+    os.utime(file_path, ns=(0, 0))
+    with ElderScrollsFile(file_path) as test_file:
+        assert test_file._read_index_file() is None
+        assert test_file[0x1acc8].type == 'BOOK'
+
+
+@pytest.mark.depends(on=['test_records_by_type'])
+def test_nested_groups(tmp_path):
+    file_path = str(tmp_path / 'nested.esp')
+    _write_nested_esp(file_path)
+    with ElderScrollsFile(file_path) as test_file:
+        assert [r.type for r in test_file._get_all_records()] == ['TES4', 'WRLD', 'CELL', 'REFR', 'REFR',
+                                                                   'ACHR', 'DIAL', 'INFO']
+        assert [r.type for r in test_file['WRLD']] == ['WRLD']
+        assert test_file[0x803].type == 'REFR'
+        assert test_file['0x806'].type == 'INFO'
+
+        groups = {}
+        _pos = test_file._groups['WRLD'][0] + 24
+        while _pos < len(test_file._mmap):
+            if test_file[_pos:_pos + 4] == b'GRUP':
+                group = Group(test_file._mmap, _pos)
+                groups[group.type] = group.label
+                _pos += 24
+            else:
+                _pos += 24 + Record(test_file._mmap, _pos).size
+        assert groups == {0: 'DIAL', 1: '0x800', 4: (-1, 2), 5: (-1, 5), 6: '0x801', 8: '0x801',
+                          9: '0x801', 7: '0x805'}
+
+
+@pytest.mark.depends(on=['test_nested_groups'])
+def test_parse_parallel(tmp_path):
+    file_path = str(tmp_path / 'nested.esp')
+    _write_nested_esp(file_path)
+    with ElderScrollsFile(file_path, use_index_file=False) as test_file:
+        assert test_file['REFR'] == []
+        form_id_index = test_file._build_form_id_index()
+        test_file.parse_parallel(workers=2)
+        assert (test_file._form_ids, test_file._form_id_positions) == form_id_index
+        assert test_file.record_types == {'WRLD', 'CELL', 'REFR', 'ACHR', 'DIAL', 'INFO'}
+        assert test_file._type_groups['REFR'] == ['WRLD']
+        assert [r.form_id for r in test_file['REFR']] == ['0x802', '0x803']
+        assert test_file[0x806].type == 'INFO'
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_merge_indices(use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(elder_scrolls_file, 'np', None)
+    indices = [(array('I', [0x800, 0x803, 0x900]), array('I', [100, 130, 160])),
+               (array('I', []), array('I', [])),
+               (array('I', [0x1, 0x801, 0x1000]), array('I', [500, 520, 540]))]
+    form_ids, positions = elder_scrolls_file._merge_indices(indices)
+    assert (form_ids, positions) == (array('I', [0x1, 0x800, 0x801, 0x803, 0x900, 0x1000]),
+                                     array('I', [500, 100, 520, 130, 160, 540]))
+    assert elder_scrolls_file._merge_indices([]) == (array('I'), array('I'))
+    assert elder_scrolls_file._sort_index(array('I', [3, 1, 2]), array('I', [30, 10, 20])) == \
+        (array('I', [1, 2, 3]), array('I', [10, 20, 30]))
+
+
+@pytest.mark.depends(on=['test_nested_groups'])
+def test_header_table(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'nested.esp')
+    _write_nested_esp(file_path)
+    with open(file_path, 'r+b') as esp:
+        esp.seek(16)
+        esp.write(struct.pack('<HH', 0x1234, 0x5678))
+    with ElderScrollsFile(file_path, use_index_file=False) as test_file:
+        monkeypatch.setattr(elder_scrolls_file, 'np', None)
+        table = test_file.header_table()
+        assert list(table) == ['offset', 'type', 'size', 'flags', 'form_id', 'timestamp', 'vc_info', 'parent']
+        assert (table['timestamp'][0], table['vc_info'][0]) == (0x1234, 0x5678)
+        assert (table['timestamp'][1], table['vc_info'][1]) == (0, 0)
+        assert [r._pointer for r in test_file._get_all_records()] == list(table['offset'])
+        assert list(table['form_id']) == [0, 0x800, 0x801, 0x802, 0x803, 0x804, 0x805, 0x806]
+        assert table['type'][3] == int.from_bytes(b'REFR', 'little')
+        assert table['parent'][0] == -1
+        assert table['parent'][1] == test_file._groups['WRLD'][0]
+        assert Group(test_file._mmap, table['parent'][3]).type == 8
+        assert table['flags'][0] == 0x200
+        monkeypatch.undo()
+
+        np = pytest.importorskip('numpy')
+        numpy_table = test_file.header_table()
+        for column in table:
+            assert list(numpy_table[column]) == list(table[column])
+        refs = numpy_table[numpy_table['type'] == int.from_bytes(b'REFR', 'little')]
+        assert list(refs['form_id']) == [0x802, 0x803]
+
+
+@pytest.mark.depends(on=['test_records_by_form_id'])
+def test_load_order(tmp_path):
+    _write_plugin(tmp_path / 'Base.esm', [],
+                  _record(b'BOOK', 0x800, _field(b'EDID', b'BaseBook\x00')),
+                  _record(b'WEAP', 0x801, _field(b'EDID', b'BaseWeapon\x00')),
+                  flags=0x1)
+    _write_plugin(tmp_path / 'Light.esp', ['Base.esm'],
+                  _record(b'BOOK', 0x800, _field(b'EDID', b'LightBook\x00')),
+                  _record(b'KYWD', 0x1000802, _field(b'EDID', b'LightKeyword\x00')),
+                  flags=0x200)
+    _write_plugin(tmp_path / 'Patch.esp', ['Base.esm', 'Light.esp'],
+                  _record(b'WEAP', 0x801, _field(b'EDID', b'PatchWeapon\x00')),
+                  _record(b'KYWD', 0x1000802, _field(b'EDID', b'PatchKeyword\x00')),
+                  _record(b'ARMO', 0x2000803, _field(b'EDID', b'PatchArmor\x00')))
+    file_paths = [str(tmp_path / name) for name in ['Base.esm', 'Light.esp', 'Patch.esp']]
+    with LoadOrder(file_paths, use_index_file=False) as load_order:
+        base, light, patch = load_order.files
+        assert load_order.get_global_form_id(light, 0x1000802) == 0xfe000802
+        assert load_order.get_global_form_id(patch, 0x1000802) == 0xfe000802
+        assert load_order.get_global_form_id(patch, 0x2000803) == 0x01000803
+        assert load_order.get_winner(0x800) is light
+        assert load_order[0x800].editor_id == 'LightBook'
+        assert load_order['0x801'].editor_id == 'PatchWeapon'
+        assert load_order[0xfe000802].editor_id == 'PatchKeyword'
+        assert load_order[0x01000803].editor_id == 'PatchArmor'
+        assert 0x02000803 not in load_order
+        with pytest.raises(KeyError):
+            load_order.get_winner(0x802)
+
+    with pytest.raises(RuntimeError):
+        LoadOrder(file_paths[1:], use_index_file=False)
+
+
+@pytest.mark.depends(on=['test_records_by_form_id'])
+def test_compressed_records():
+    with ElderScrollsFile('./esp/test_basic_esp_functionality.esp', use_index_file=False) as test_file:
+        npc = test_file[0x4000800]
+        assert npc.is_compressed
+        assert [f.name for f in npc][:3] == ['EDID', 'VMAD', 'OBND']
+        assert npc.editor_id == str(test_file[0x4000800]['EDID'])
+        assert npc.content is test_file[0x4000800].content
+        assert (test_file._mmap, npc._pointer) in _inflated_contents
+    assert (test_file._mmap, npc._pointer) not in _inflated_contents
+
+
+@pytest.mark.depends(on=['test_compressed_records', 'test_nested_groups'])
+def test_save(tmp_path):
+    output_path = str(tmp_path / 'saved.esp')
+    with ElderScrollsFile('./esp/test_basic_esp_functionality.esp', use_index_file=False) as test_file:
+        book = test_file[0x1acc8]
+        book['EDID'] = b'ChangedBook\x00'
+        assert test_file[0x1acc8] is book
+        assert book.is_changed and book.editor_id == 'ChangedBook'
+        npc = test_file[0x4000800]
+        npc['XNAM'] = b'\x01' * 70000
+        with pytest.raises(ValueError):
+            test_file.save('./esp/test_basic_esp_functionality.esp')
+        test_file.save(output_path)
+        original_records = [(r.type, r.form_id, bytes(r.content)) for r in test_file._get_all_records()]
+
+    with ElderScrollsFile(output_path, use_index_file=False) as saved_file:
+        assert saved_file.record_count == 34
+        assert saved_file[0x1acc8].editor_id == 'ChangedBook'
+        assert saved_file[0x4000800].is_compressed
+        assert bytes(dict(saved_file[0x4000800]._iter_field_contents())['XNAM']) == b'\x01' * 70000
+        assert [(r.type, r.form_id, bytes(r.content)) for r in saved_file._get_all_records()] == original_records
+        assert len(saved_file['NPC_']) == 2
+
+    file_path = str(tmp_path / 'nested.esp')
+    _write_nested_esp(file_path)
+    with ElderScrollsFile(file_path, use_index_file=False) as test_file:
+        test_file[0x803]['EDID'] = b'PlacedReference\x00'
+        test_file.save(output_path)
+    with ElderScrollsFile(output_path, use_index_file=False) as saved_file:
+        assert [r.type for r in saved_file._get_all_records()] == ['TES4', 'WRLD', 'CELL', 'REFR', 'REFR',
+                                                                    'ACHR', 'DIAL', 'INFO']
+        assert saved_file[0x803].editor_id == 'PlacedReference'
+        assert saved_file.record_count == 16
+
+
 @pytest.mark.depends(on=['test_header_record', 'test_fields'])
 def test_records():
     with ElderScrollsFile('./esp/test_basic_esp_functionality.esp') as test_file:
@@ -0,0 +1,70 @@
+import os
+import struct
+
+import pytest
+from elder_scrolls import ElderScrollsFile
+from elder_scrolls.bsa_file import BethesdaSoftwareArchive
+from elder_scrolls.bsa_packer import pack_archive
+from elder_scrolls.string_table import StringTable
+from .test_elder_scrolls import _field, _record, _write_plugin
+
+
+STRINGS = {0x10: 'Iron Sword', 0x11: 'Ulfric Stormcloak', 0x2a: 'Zweihänder', 0x100: ''}
+
+
+def _string_table(strings, has_lengths: bool) -> bytes:
+    directory, data = [], b''
+    for string_id, string in sorted(strings.items()):
+        directory.append(struct.pack('<II', string_id, len(data)))
+        encoded = string.encode('utf-8') + b'\x00'
+        data += (struct.pack('<I', len(encoded)) if has_lengths else b'') + encoded
+    return struct.pack('<II', len(strings), len(data)) + b''.join(directory) + data
+
+
+def _write_string_tables(folder_path, plugin_name):
+    os.makedirs(folder_path, exist_ok=True)
+    for extension in ('STRINGS', 'DLSTRINGS', 'ILSTRINGS'):
+        with open(os.path.join(folder_path, f'{plugin_name}_English.{extension}'), 'wb') as string_table:
+            string_table.write(_string_table(STRINGS, extension != 'STRINGS'))
+
+
+@pytest.mark.parametrize('extension', ['strings', 'dlstrings'])
+def test_string_table(extension, tmp_path):
+    file_path = tmp_path / f'Test_english.{extension}'
+    file_path.write_bytes(_string_table(STRINGS, extension == 'dlstrings'))
+    with StringTable(str(file_path), cache_size=16) as strings:
+        assert len(strings) == len(STRINGS)
+        for string_id, string in STRINGS.items():
+            assert strings[string_id] == string
+        assert strings[0x11] == 'Ulfric Stormcloak'
+        assert 0x2a in strings
+        assert 0x12 not in strings
+        assert strings.get(0x12) is None
+        with pytest.raises(KeyError):
+            strings[0x1000]
+        assert strings._cache.size <= 16
+
+
+def test_localized_plugin(tmp_path):
+    _write_plugin(tmp_path / 'Test.esp', [],
+                  _record(b'WEAP', 0x800, _field(b'EDID', b'Sword\x00'), _field(b'FULL', struct.pack('<I', 0x10))),
+                  flags=0x80)
+    with ElderScrollsFile(str(tmp_path / 'Test.esp'), use_index_file=False) as test_file:
+        assert test_file.is_localized
+        assert test_file.strings is None
+        weapons = test_file.get_group('WEAP')
+        with pytest.raises(FileNotFoundError):
+            test_file.load_strings()
+        _write_string_tables(tmp_path / 'Strings', 'Test')
+        test_file.load_strings()
+        assert test_file[0x800].full_name == 'Iron Sword'
+        assert [weapon.full_name for weapon in weapons._get_all_records()] == ['Iron Sword']
+        assert test_file.strings['dlstrings'][0x2a] == 'Zweihänder'
+
+    _write_string_tables(tmp_path / 'Archived' / 'Strings', 'Test')
+    pack_archive(str(tmp_path / 'Archived'), str(tmp_path / 'Test.bsa'), version=104)
+    with BethesdaSoftwareArchive(str(tmp_path / 'Test.bsa')) as archive:
+        with ElderScrollsFile(str(tmp_path / 'Test.esp'), use_index_file=False) as test_file:
+            test_file.load_strings('english', archive)
+            assert test_file[0x800].full_name == 'Iron Sword'
+            assert test_file.strings['ilstrings'][0x11] == 'Ulfric Stormcloak'